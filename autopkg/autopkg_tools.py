@@ -7,25 +7,95 @@
 """Wrapper script for handling AutoPKG operations."""
 
 import os
-import json
+import sys
+import argparse
 import subprocess
 import plistlib
+import tempfile
+import threading
 import traceback
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 from datetime import date
 from datetime import datetime
+from datetime import timedelta
 from datetime import timezone
-import requests
+
+# Shared modules live next to the other helper scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "helpers"))
+import github_api
+import make_catalogs
+import notify
+import pkg_manifest
+import recipe_catalog
+import run_journal
+import run_trace
+import stream_cmd
+import trust_cache
+import upstream_check
 
 WEBHOOK_URL = os.environ["SLACK_WEBHOOK"]
 GIT = "/usr/bin/git"
-GITHUB_CLI = "gh"
 REPO_DIR = os.environ["GITHUB_WORKSPACE"] + "/munki_repo"
 PKGSINFO_DIR = os.environ["GITHUB_WORKSPACE"] + "/munki_repo" + "/pkgsinfo"
 CATALOGS_DIR = os.environ["GITHUB_WORKSPACE"] + "/munki_repo" + "/catalogs"
+PKGS_DIR = os.environ["GITHUB_WORKSPACE"] + "/munki_repo" + "/pkgs"
+PKG_MANIFEST_PATH = os.path.join(REPO_DIR, pkg_manifest.MANIFEST_NAME)
 RECIPE_DIR = os.environ["GITHUB_WORKSPACE"] + "/autopkg/RecipeOverrides"
 GITHUB_TOKEN = os.environ["GITHUB_TOKEN"]
+GITHUB_API = github_api.GitHubClient(os.environ.get("GITHUB_REPOSITORY"), GITHUB_TOKEN)
+# Login of the GITHUB_TOKEN user in REST responses
+BOT_LOGIN = "github-actions[bot]"
 INPUT_RECIPES = os.environ["INPUT_RECIPES"].split()
 REVIEWERS = os.environ["REVIEWERS"].split(",")
+# Number of recipes run by `autopkg` at the same time
+AUTOPKG_WORKERS = max(1, int(os.environ.get("AUTOPKG_WORKERS") or 1))
+# Recipes passed to one `autopkg run` as a recipe list, 0 or 1 runs them one by one
+AUTOPKG_BATCH_SIZE = max(0, int(os.environ.get("AUTOPKG_BATCH_SIZE") or 0))
+# Every recipe writes its own report plist in here
+REPORTS_DIR = tempfile.mkdtemp(prefix="autopkg_reports_")
+# Commits are pushed once this many have piled up, 0 pushes once at the end
+PUSH_BATCH_SIZE = max(0, int(os.environ.get("PUSH_BATCH_SIZE") or 0))
+# Git commands can come from several worker threads, run them one at a time
+GIT_LOCK = threading.Lock()
+# Closed issues younger than this are reopened instead of filing a new one
+ISSUE_REOPEN_DAYS = 6
+# Open and recently closed issues by normalized title, see load_issue_index()
+ISSUE_INDEX = {}
+ISSUE_INDEX_LOADED = False
+# Overrides that verified before, keyed on their trust fingerprint
+TRUST_CACHE_PATH = os.environ.get("TRUST_CACHE") or os.path.join(
+    os.environ["GITHUB_WORKSPACE"], ".cache", "trust_cache.json"
+)
+TRUST_CACHE = trust_cache.load_cache(TRUST_CACHE_PATH)
+# Parsed overrides, refreshed for whatever changed since the last run
+RECIPE_CATALOG_PATH = os.environ.get("RECIPE_CATALOG") or os.path.join(
+    os.environ["GITHUB_WORKSPACE"], ".cache", "recipe_catalog.json"
+)
+RECIPE_CATALOG = recipe_catalog.load_catalog(RECIPE_DIR, RECIPE_CATALOG_PATH)
+# Skip recipes whose cached downloads didn't change upstream, see upstream_check.py
+UPSTREAM_PRECHECK = os.environ.get("UPSTREAM_PRECHECK", "").lower() in ("1", "true")
+AUTOPKG_CACHE_DIR = os.environ.get("AUTOPKG_CACHE_DIR") or os.path.expanduser(
+    "~/Library/AutoPkg/Cache"
+)
+# Slack posts go through a background sender, undelivered ones spill to .cache
+NOTIFIER = notify.Dispatcher()
+# Per-recipe logs of the autopkg output and command timeouts in seconds
+LOG_DIR = os.environ.get("LOG_DIR") or os.path.join(
+    os.environ["GITHUB_WORKSPACE"], "autopkg_logs"
+)
+RECIPE_TIMEOUT = int(os.environ.get("RECIPE_TIMEOUT") or 3600)
+VERIFY_TIMEOUT = int(os.environ.get("VERIFY_TIMEOUT") or 300)
+GIT_TIMEOUT = int(os.environ.get("GIT_TIMEOUT") or 600)
+# Where the timing spans of the run are exported to
+TRACE_DIR = os.environ.get("TRACE_DIR") or os.path.join(
+    os.environ["GITHUB_WORKSPACE"], "trace"
+)
+# Progress of the current run, read back by --resume
+JOURNAL_PATH = os.environ.get("RUN_JOURNAL") or os.path.join(
+    os.environ["GITHUB_WORKSPACE"], "run_journal.json"
+)
 
 
 class Error(Exception):
@@ -41,47 +111,50 @@ class BranchError(Error):
 
 
 # Utility functions
-def run_cmd(cmd):
+def span_name(cmd):
+    """Name a subprocess span after the binary and its subcommand."""
+    return " ".join([os.path.basename(str(cmd[0]))] + [str(arg) for arg in cmd[1:2]])
+
+
+def run_cmd(cmd, cwd=None, timeout=GIT_TIMEOUT):
     """Run a command and return the output."""
     try:
-        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        results_dict = {
-            "stdout": proc.stdout,
-            "stderr": proc.stderr,
-            "status": proc.returncode,
-            "success": proc.returncode == 0,
-        }
-        return results_dict
-    except subprocess.SubprocessError as e:
+        with run_trace.span(span_name(cmd)):
+            return stream_cmd.run(cmd, cwd=cwd, timeout=timeout, capture_stdout=True)
+    except (OSError, subprocess.SubprocessError) as e:
         print(f"Subprocess failed: {e}")
         return {
             "stdout": b"",
             "stderr": f"SubprocessError: {e}".encode("utf-8"),
             "status": -1,
             "success": False,
+            "timed_out": False,
         }
 
 
-def run_live(command):
-    """Run a command with real-time output"""
-    proc = subprocess.run(command, stderr=subprocess.PIPE, text=True)
-    results_dict = {
-        "status": proc.returncode,
-        "success": proc.returncode == 0,
-        "stderr": proc.stderr,
-    }
+def run_live(command, log_path=None, timeout=None):
+    """Run a command with real-time output, teed to log_path"""
+    with run_trace.span(span_name(command)):
+        results_dict = stream_cmd.run(
+            command, log_path=log_path, timeout=timeout, echo=True
+        )
+    # only the tail of stderr is kept
+    results_dict["stderr"] = results_dict["stderr"].decode("utf-8", "replace")
     return results_dict
 
 
 # Recipe handling
 def get_recipes():
     """Create the list of overrides to run"""
-    recipes = []
-    for root, dirs, files in os.walk("autopkg/RecipeOverrides"):
-        for file in files:
-            if file.endswith(".recipe") or file.endswith(".recipe.yaml"):
-                recipes.append(file)
-    return recipes
+    return [entry["file"] for entry in RECIPE_CATALOG.values()]
+
+
+def recipe_identifier(recipe):
+    """Return the Identifier of a recipe override, None if we can't tell."""
+    _, entry = recipe_catalog.find(RECIPE_CATALOG, recipe)
+    if not entry:
+        return None
+    return entry["identifier"]
 
 
 def parse_recipe_name(identifier):
@@ -90,6 +163,11 @@ def parse_recipe_name(identifier):
     return recipename
 
 
+def report_plist_path(recipe):
+    """Return the private report plist path for a recipe."""
+    return os.path.join(REPORTS_DIR, f"{os.path.basename(recipe)}.plist")
+
+
 def parse_report_plist(report_plist_path):
     """Parse the report plist path for a dict of the results."""
     imported_items = []
@@ -124,34 +202,89 @@ def parse_report_plist(report_plist_path):
 
 
 # Git/Hub-related functions
+def normalize_title(issue_title):
+    """Normalize an issue title for lookups in the issue index."""
+    return " ".join(str(issue_title).split()).lower()
+
+
+def index_issue(issue):
+    """Add or replace an issue in the issue index."""
+    ISSUE_INDEX[normalize_title(issue.title)] = issue
+
+
+def indexed_issue_by_number(issue_number):
+    """Return the indexed issue with the given number, if there is one."""
+    for issue in ISSUE_INDEX.values():
+        if str(issue.number) == str(issue_number):
+            return issue
+    return None
+
+
+def load_issue_index():
+    """
+    Fetch the open and recently closed issues, and the comments on them,
+    once for the whole run so issue lookups don't need an API call per recipe.
+    """
+    global ISSUE_INDEX_LOADED
+    closed_since = datetime.now(timezone.utc) - timedelta(days=ISSUE_REOPEN_DAYS + 1)
+    try:
+        # older closed issues are never reopened, a new issue gets filed instead
+        closed_issues = GITHUB_API.list_issues(
+            "closed", since=closed_since.strftime("%Y-%m-%dT%H:%M:%SZ")
+        )
+        open_issues = GITHUB_API.list_issues("open")
+        issues = closed_issues + open_issues
+        # no comment on an issue can be older than the issue itself
+        commented = [issue for issue in issues if issue.comment_count]
+        comments = []
+        if commented:
+            oldest = min(issue.created_at for issue in commented)
+            comments = GITHUB_API.list_comments(since=oldest)
+    except github_api.GitHubError as e:
+        print(f"Could not build the issue index, searching per issue instead: {e}")
+        return
+    ISSUE_INDEX.clear()
+    # open issues win if a title shows up in both lists
+    for issue in issues:
+        index_issue(issue)
+    by_number = {issue.number: issue for issue in issues}
+    for comment in comments:
+        if comment.issue_number in by_number:
+            by_number[comment.issue_number].comment_authors.append(comment.author)
+    ISSUE_INDEX_LOADED = True
+    print(f"Indexed {len(ISSUE_INDEX)} open and recently closed issues")
+
+
+def search_issue(issue_title):
+    """Search GitHub for an issue with the given title."""
+    try:
+        issues = GITHUB_API.search_issues(issue_title)
+    except github_api.GitHubError as e:
+        print(f"Issue search failed: {e}")
+        return None
+    for issue in issues:
+        if issue_title.lower() == issue.title.lower():
+            return issue
+    return None
+
+
 def issue_exists(issue_title):
     """
     Check if an issue with the given title already exists
     and return its URL and number if it does.
     """
-    command = [
-        "gh",
-        "issue",
-        "list",
-        "--search",
-        issue_title,
-        "--state",
-        "all",
-        "--json",
-        "title,url,number,state,updatedAt",
-    ]
-    result = run_cmd(command)
-    if result["success"]:
-        issues = json.loads(result["stdout"])
-        for issue in issues:
-            if issue_title.lower() == issue["title"].lower():
-                return (
-                    True,
-                    issue["url"],
-                    str(issue["number"]),
-                    issue["state"],
-                    issue["updatedAt"],
-                )
+    if ISSUE_INDEX_LOADED:
+        issue = ISSUE_INDEX.get(normalize_title(issue_title))
+    else:
+        issue = search_issue(issue_title)
+    if issue:
+        return (
+            True,
+            issue.url,
+            str(issue.number),
+            issue.state,
+            issue.updated_at,
+        )
     return False, None, None, None, None
 
 
@@ -159,45 +292,65 @@ def get_issue_comments(issue_number):
     """
     Retrieve comments for a given issue number.
     """
-    command = ["gh", "issue", "view", issue_number, "--json", "comments"]
-    result = run_cmd(command)
-    if result["success"]:
-        issue_data = json.loads(result["stdout"])
-        comments = issue_data.get("comments", [])
-        return comments
-    return []
+    try:
+        return GITHUB_API.list_issue_comments(issue_number)
+    except github_api.GitHubError as e:
+        print(f"Failed to get comments: {e}")
+        return []
+
+
+def get_comment_authors(issue_number):
+    """Return the logins of everyone that commented on an issue."""
+    issue = indexed_issue_by_number(issue_number)
+    if issue:
+        return issue.comment_authors
+    return [comment.author for comment in get_issue_comments(issue_number)]
+
+
+def update_indexed_issue(issue):
+    """Replace an issue in the index, keeping the comment authors we know of."""
+    indexed = indexed_issue_by_number(issue.number)
+    if indexed:
+        issue.comment_authors = indexed.comment_authors
+        ISSUE_INDEX.pop(normalize_title(indexed.title), None)
+    issue.comment_authors.append(BOT_LOGIN)
+    index_issue(issue)
 
 
 def add_comment_to_issue(issue_url, comment_body):
     """Add a comment to an existing GitHub issue."""
     issue_number = issue_url.rstrip("/").split("/")[-1]
-    command = ["gh", "issue", "comment", issue_number, "--body", comment_body]
-    result = run_cmd(command)
-    if result["success"]:
-        print(f"Comment added to issue: {issue_url}")
-    else:
-        print(f"Failed to add comment: {result['stderr']}")
+    try:
+        comment = GITHUB_API.add_comment(issue_number, comment_body)
+    except github_api.GitHubError as e:
+        print(f"Failed to add comment: {e}")
+        return
+    print(f"Comment added to issue: {issue_url}")
+    issue = indexed_issue_by_number(issue_number)
+    if issue:
+        issue.comment_authors.append(comment.author)
 
 
 def close_github_issue(issue_number, issue_url, comment_body):
-    command = ["gh", "issue", "close", issue_number, "--comment", comment_body]
-    result = run_cmd(command)
-    if result["success"]:
-        print(f"Issue closed: {issue_url}")
-    else:
-        print(f"Failed to close issue: {result['stderr']}")
+    try:
+        issue = GITHUB_API.close_issue(issue_number, comment_body)
+    except github_api.GitHubError as e:
+        print(f"Failed to close issue: {e}")
+        return
+    print(f"Issue closed: {issue_url}")
+    update_indexed_issue(issue)
 
 
 def reopen_github_issue(issue_number, comment_body):
-    command = ["gh", "issue", "reopen", issue_number, "--comment", comment_body]
-    result = run_cmd(command)
-    if result["success"]:
-        print(f"Issue reopened: #{issue_number}")
-        reopened_comment_time = datetime.now(timezone.utc).isoformat()
-        return reopened_comment_time
-    else:
-        print(f"Failed to reopen issue: {result['stderr']}")
+    try:
+        issue = GITHUB_API.reopen_issue(issue_number, comment_body)
+    except github_api.GitHubError as e:
+        print(f"Failed to reopen issue: {e}")
         return None
+    print(f"Issue reopened: #{issue_number}")
+    reopened_comment_time = datetime.now(timezone.utc).isoformat()
+    update_indexed_issue(issue)
+    return reopened_comment_time
 
 
 def create_github_issue(issue_title, issue_body):
@@ -210,7 +363,7 @@ def create_github_issue(issue_title, issue_body):
             updated_date = datetime.strptime(
                 issue_updated_at, "%Y-%m-%dT%H:%M:%SZ"
             ).replace(tzinfo=timezone.utc)
-            if (datetime.now(timezone.utc) - updated_date).days <= 6:
+            if (datetime.now(timezone.utc) - updated_date).days <= ISSUE_REOPEN_DAYS:
                 reopen_comment = f"Reopening issue due to new error: {issue_body}"
                 reopened_comment_time = reopen_github_issue(
                     issue_number, reopen_comment
@@ -221,10 +374,14 @@ def create_github_issue(issue_title, issue_body):
             comment_body = f"Latest AutoPkg run error message: {issue_body}"
             add_comment_to_issue(issue_url, comment_body)
             return issue_url, None
-    command = ["gh", "issue", "create", "--title", issue_title, "--body", issue_body]
-    result = run_cmd(command)
-    issue_url = result.get("stdout", "").strip()
-    return issue_url, None
+    try:
+        issue = GITHUB_API.create_issue(issue_title, issue_body)
+    except github_api.GitHubError as e:
+        print(f"Failed to create issue: {e}")
+        return "", None
+    if ISSUE_INDEX_LOADED:
+        index_issue(issue)
+    return issue.url, None
 
 
 def handle_existing_issue_on_success(recipe_name):
@@ -234,9 +391,9 @@ def handle_existing_issue_on_success(recipe_name):
     """
     exists, issue_url, issue_number, issue_state, _ = issue_exists(recipe_name)
     if exists:
-        comments = get_issue_comments(issue_number)
+        comment_authors = get_comment_authors(issue_number)
         only_github_actions = all(
-            comment["author"]["login"] == "github-actions" for comment in comments
+            author in ("github-actions", BOT_LOGIN) for author in comment_authors
         )
         comment_body = f"{recipe_name} has run successfully. This issue should be closed automatically. Testing..."
         add_comment_to_issue(issue_url, comment_body)
@@ -261,11 +418,9 @@ def create_issue(recipe, error_message):
 def git_run(arglist):
     """Run git with the argument list."""
     # Only run git commands in the munki repo dir
-    owd = os.getcwd()
-    os.chdir(REPO_DIR)
     gitcmd = [GIT] + [str(arg) for arg in arglist]
-    results = run_cmd(gitcmd)
-    os.chdir(owd)
+    with GIT_LOCK:
+        results = run_cmd(gitcmd, cwd=REPO_DIR)
     if not results["success"]:
         raise GitError("Git error: %s" % results["stderr"])
     return results["stdout"]
@@ -287,7 +442,7 @@ def current_branch():
 
 
 def create_feature_branch(branchname):
-    """Create new feature branch."""
+    """Create new feature branch and return its name."""
     if current_branch() != "master":
         # switch to master first if we're not already there
         change_feature_branch("master")
@@ -296,6 +451,21 @@ def create_feature_branch(branchname):
     if existing_branch:
         branchname = f"{branchname}-2"
     change_feature_branch(branchname, new=True)
+    return branchname
+
+
+def resume_feature_branch(branchname):
+    """Switch back to the branch of an interrupted run, fetching it if needed."""
+    if branchname in branch_list():
+        change_feature_branch(branchname)
+    elif branch_exists(branchname):
+        git_run(["fetch", "origin", branchname])
+        git_run(["checkout", "-b", branchname, "--track", f"origin/{branchname}"])
+    else:
+        # nothing was pushed before the run died
+        if current_branch() != "master":
+            change_feature_branch("master")
+        change_feature_branch(branchname, new=True)
 
 
 def branch_exists(branchname):
@@ -327,11 +497,45 @@ def change_feature_branch(branchname, new=False):
         raise BranchError("Couldn't switch to '%s': %s" % (branchname, e))
 
 
+def record_package(imported_item):
+    """Merge the hashes of an imported package into the package manifest."""
+    manifest = pkg_manifest.load_manifest(PKG_MANIFEST_PATH)
+    pkg_manifest.prune(manifest, PKGSINFO_DIR)
+    pkg_manifest.record(
+        manifest,
+        imported_item["pkg_repo_path"],
+        imported_item["pkg_hashes"],
+        imported_item.get("pkginfo_path"),
+    )
+    pkg_manifest.save_manifest(manifest, PKG_MANIFEST_PATH)
+
+
+def tracked_pkginfo():
+    """Return the pkginfo paths, relative to pkgsinfo, in the git index."""
+    output = git_run(["ls-files", "-z", "--", "pkgsinfo"]).decode()
+    return {os.path.relpath(path, "pkgsinfo") for path in output.split("\0") if path}
+
+
 def create_commit(imported_item):
     """Create git commit."""
+    pkginfo_path = imported_item.get("pkginfo_path")
+    # A package without its pkginfo can't be pruned later, so it isn't recorded
+    if imported_item.get("pkg_hashes") and pkginfo_path:
+        record_package(imported_item)
     print("Adding items...")
-    gitaddcmd = ["add", PKGSINFO_DIR, CATALOGS_DIR]
+    # Other recipes may still be importing, so only stage this item's pkginfo
+    if pkginfo_path:
+        gitaddcmd = ["add", os.path.join(PKGSINFO_DIR, pkginfo_path)]
+    else:
+        gitaddcmd = ["add", PKGSINFO_DIR]
+    if os.path.exists(PKG_MANIFEST_PATH):
+        gitaddcmd.append(PKG_MANIFEST_PATH)
     git_run(gitaddcmd)
+    # The catalogs only list pkginfo files that are committed or staged, so
+    # every commit (and every partial push) is consistent on its own
+    with run_trace.span("make catalogs"):
+        make_catalogs.make_catalogs(REPO_DIR, include=tracked_pkginfo())
+    git_run(["add", CATALOGS_DIR])
     print("Creating commit...")
     gitcommitcmd = ["commit", "-m"]
     message = "update %s to version %s" % (
@@ -342,6 +546,22 @@ def create_commit(imported_item):
     git_run(gitcommitcmd)
 
 
+def head_commit():
+    """Return the hash of the current HEAD commit."""
+    return git_run(["rev-parse", "HEAD"]).decode().strip()
+
+
+def commit_exists(commit):
+    """Check if a commit is available in the local repo."""
+    if not commit:
+        return False
+    try:
+        git_run(["cat-file", "-e", f"{commit}^{{commit}}"])
+    except GitError:
+        return False
+    return True
+
+
 def git_push(branchname):
     """Perform a git push."""
     print("Running `git push`...")
@@ -361,23 +581,33 @@ def git_push(branchname):
 
 
 def pull_request(branchname):
-    """Create Pull request using the gh cli tool."""
+    """Create Pull request through the GitHub API."""
     if not GITHUB_TOKEN:
         print("Pull request not created.. GITHUB_TOKEN not set")
         return
     print("Creating Pull Request...")
-    run_cmd([GITHUB_CLI, "pr", "create", "-B", "master", "-H", branchname, "-f"])
+    try:
+        if GITHUB_API.find_pull_request(branchname):
+            print(f"Pull request for {branchname} exists already")
+            return
+        GITHUB_API.create_pull_request(
+            branchname, "master", f"AutoPkg imports {branchname}"
+        )
+    except github_api.GitHubError as e:
+        print(f"Failed to create pull request: {e}")
 
 
 def pull_request_link(branchname):
     """Get Pull Request Link"""
-    prcmd = [GITHUB_CLI, "pr", "view", "--json", "url", "-q", ".url"]
     try:
-        link = run_cmd(prcmd)
-        print("Got PR link")
-        return link
-    except GitError as e:
+        pull = GITHUB_API.find_pull_request(branchname)
+    except github_api.GitHubError as e:
         print("Failed to get pull request link from %s" % branchname)
+        return ""
+    if not pull:
+        return ""
+    print("Got PR link")
+    return pull.url
 
 
 # Slack related functions
@@ -507,7 +737,7 @@ def git_pr_message(pr_link, build_duration, issues):
 
 
 def format_slack_message(
-    imported, failed, link_msg, virus_total_results, build_duration, issues
+    imported, failed, link_msg, virus_total_results, build_duration, issues, skipped=()
 ):
     """Compose notification to be sent to slack"""
     message = {
@@ -542,6 +772,18 @@ def format_slack_message(
         message["attachments"][0]["blocks"].extend(
             imported_message(imported, virus_total_results)
         )
+    if skipped:
+        message["attachments"][0]["blocks"].append(
+            {
+                "type": "context",
+                "elements": [
+                    {
+                        "type": "mrkdwn",
+                        "text": f":fast_forward: Skipped {len(skipped)} recipes without upstream changes",
+                    }
+                ],
+            }
+        )
     if failed:
         message["attachments"].extend(failures_message(failed))
     if link_msg:
@@ -550,116 +792,575 @@ def format_slack_message(
     return message
 
 
+def log_post_status(future):
+    """Log the outcome of a background Slack post."""
+    if future.exception():
+        print(f"Slack Message post failed: {future.exception()}")
+    elif future.result():
+        print(f"Slack Message post status: {future.result()}")
+
+
 def post_to_slack(message):
     """Post slack message to the WEBHOOK_URL"""
     if not WEBHOOK_URL:
         print("Slack Webhook not set.. No notification sent.")
         return
-    response = requests.post(
-        WEBHOOK_URL,
-        data=json.dumps(message),
-        headers={"Content-Type": "application/json"},
-    )
-    print(f"Slack Message post status: {response.status_code}: {response.text}")
+    # sent in the background, the run doesn't wait on Slack
+    future = NOTIFIER.post_webhook(message)
+    future.add_done_callback(log_post_status)
+    return future
+
+
+def mark_notified(journal, recipes, future=None):
+    """
+    Journal recipes as notified, with a future only once its Slack post was
+    delivered. A failed or spilled post leaves them for --resume to send again.
+    """
+    if future is not None and (future.exception() or not future.result()):
+        return
+    for recipe in recipes:
+        run_journal.mark(journal, recipe, "notified")
 
 
 # Autopkg execution functions
 def autopkg_verify_update(recipe):
-    """Run verification and update on a recipe trust if it fails"""
+    """
+    Run verification and update on a recipe trust if it fails.
+    Returns the override that was updated, the main thread commits it.
+    """
+    cache_key, entry = recipe_catalog.find(RECIPE_CATALOG, recipe)
+    if entry:
+        fingerprint = trust_cache.fingerprint_trust(entry["sha256"], entry["trust"])
+        if trust_cache.is_verified(TRUST_CACHE, cache_key, fingerprint):
+            print(f"Trust info of {recipe} is unchanged, skipping verification")
+            return None
     verify_cmd = ["/usr/local/bin/autopkg", "verify-trust-info", recipe]
-    verification_result = run_live(verify_cmd)
+    verification_result = run_live(
+        verify_cmd, recipe_log_path(recipe), timeout=VERIFY_TIMEOUT
+    )
+    if entry:
+        # only a successful verification is remembered
+        trust_cache.record(
+            TRUST_CACHE,
+            TRUST_CACHE_PATH,
+            cache_key,
+            fingerprint if verification_result["success"] else None,
+        )
 
     if not verification_result["success"]:
         update_cmd = ["/usr/local/bin/autopkg", "update-trust-info", recipe]
-        run_live(update_cmd)
-        recipeaddcmd = ["add"]
-        recipeaddcmd.append(RECIPE_DIR)
-        git_run(recipeaddcmd)
+        run_live(update_cmd, recipe_log_path(recipe), timeout=VERIFY_TIMEOUT)
+        # an override missing from the catalog can only be found by autopkg
+        if cache_key:
+            return os.path.join(RECIPE_DIR, cache_key)
+        return RECIPE_DIR
+    return None
 
 
-def autopkg_run(recipe):
+def commit_trust_update(recipe, override_path):
+    """
+    Commit the updated trust info of a recipe on its own, leaving anything else
+    that is staged alone. Returns the commit, None if nothing changed.
+    """
+    git_run(["add", override_path])
+    try:
+        git_run(["diff", "--cached", "--quiet", "--", override_path])
+        return None
+    except GitError:
+        pass
+    message = f"update trust info of {recipe}"
+    git_run(["commit", "-m", message, "--", override_path])
+    return head_commit()
+
+
+def recipe_log_path(recipe):
+    """Return the log file the output of a recipe's autopkg commands goes to."""
+    return os.path.join(LOG_DIR, f"{recipe}.log")
+
+
+def autopkg_run(recipe, report_plist="report.plist"):
     """Run autopkg on given recipe"""
-    autopkg_verify_update(recipe)
     autopkg_cmd = ["/usr/local/bin/autopkg", "run", "-vvv"]
     autopkg_cmd.append(recipe)
     autopkg_cmd.append("--report-plist")
-    autopkg_cmd.append("report.plist")
+    autopkg_cmd.append(report_plist)
     autopkg_cmd.append("--post")
     autopkg_cmd.append("io.github.hjuutilainen.VirusTotalAnalyzer/VirusTotalAnalyzer")
-    run_live(autopkg_cmd)
+    return run_live(autopkg_cmd, recipe_log_path(recipe), timeout=RECIPE_TIMEOUT)
 
 
-def handle_recipes():
-    imported = []
-    failed = []
-    issues = []
-    virus_total_results = []
-    today = date.today()
-    branchname = f"munkiapps_{today}"
-    if INPUT_RECIPES:
-        recipes = INPUT_RECIPES
+def missing_report(recipes, result):
+    """Fail every recipe of an autopkg run that died before writing its report."""
+    if result["timed_out"]:
+        message = "AutoPkg timed out."
     else:
-        recipes = get_recipes()
-    # Start the timer
-    start_time = datetime.now()
-    # Create the new branch
-    create_feature_branch(branchname)
-    # Run the recipe (file) list
+        message = "AutoPkg did not write a report plist."
+    if result["stderr"]:
+        message += "\n" + result["stderr"][-4000:]
+    return {
+        recipe: {
+            "imported": [],
+            "failed": [{"recipe": recipe, "message": message}],
+            "virus_total": [],
+        }
+        for recipe in recipes
+    }
+
+
+def run_recipe(recipe, journal):
+    """
+    Run a single recipe with its own report plist and return the parsed results.
+    This is what the worker threads execute, it must not touch the git branch.
+    """
+    with run_trace.span("recipe", recipe):
+        with run_trace.span("verify"):
+            trust_updated = autopkg_verify_update(recipe)
+        run_journal.mark(journal, recipe, "verified")
+        report_plist = report_plist_path(recipe)
+        if os.path.exists(report_plist):
+            os.remove(report_plist)
+        with run_trace.span("autopkg run"):
+            result = autopkg_run(recipe, report_plist)
+        run_journal.mark(journal, recipe, "ran")
+        if not os.path.exists(report_plist):
+            # autopkg died before it could write a report
+            run_results = missing_report([recipe], result)[recipe]
+        else:
+            with run_trace.span("parse report"):
+                run_results = parse_report_plist(report_plist)
+        if trust_updated:
+            run_results["trust_updated"] = trust_updated
+        return run_results
+
+
+def run_and_hash(recipes, journal):
+    """
+    Run a chunk of recipes and hash the packages they imported, while still in
+    the worker thread so the main thread only has to merge the hashes.
+    """
+    batch_results = run_batch(recipes, journal)
+    for run_results in batch_results.values():
+        for item in run_results["imported"]:
+            pkg_repo_path = item.get("pkg_repo_path")
+            if not pkg_repo_path:
+                continue
+            pkg_path = os.path.join(PKGS_DIR, pkg_repo_path)
+            if not os.path.isfile(pkg_path):
+                continue
+            with run_trace.span("hash package", pkg=pkg_repo_path):
+                item["pkg_hashes"] = pkg_manifest.hash_package(pkg_path)
+    return batch_results
+
+
+def plan_batches(recipes):
+    """
+    Split recipes into the chunks that run as one `autopkg run` each.
+    Results of a chunk are matched back to recipes by their NAME, so a chunk
+    never holds two recipes with the same NAME and recipes without a known
+    NAME get a chunk of their own.
+    """
+    if AUTOPKG_BATCH_SIZE <= 1:
+        return [[recipe] for recipe in recipes]
+    batches = []
+    singles = []
     for recipe in recipes:
-        # Parse the recipe name for basic item name
-        recipename = parse_recipe_name(recipe)
-        # change to branch that was created above
-        change_feature_branch(branchname)
-        # Run Autopkg
-        autopkg_run(recipe)
-        # Parse the results from report plist
-        run_results = parse_report_plist("report.plist")
-        if not run_results["imported"] and not run_results["failed"]:
-            # Nothing happened
+        _, entry = recipe_catalog.find(RECIPE_CATALOG, recipe)
+        name = (entry or {}).get("name")
+        if not name:
+            singles.append([recipe])
             continue
-        if run_results["failed"]:
-            # Add to list of failed items
-            failed.append(run_results["failed"][0])
-            # create issue
+        for batch in batches:
+            if len(batch) < AUTOPKG_BATCH_SIZE and name.lower() not in {
+                recipe_name(other).lower() for other in batch
+            }:
+                batch.append(recipe)
+                break
+        else:
+            batches.append([recipe])
+    return batches + singles
+
+
+def recipe_name(recipe):
+    """Return the NAME input of a recipe from the catalog."""
+    _, entry = recipe_catalog.find(RECIPE_CATALOG, recipe)
+    return (entry or {}).get("name") or ""
+
+
+def attribute_results(recipes, report_results):
+    """
+    Split the results of a combined report plist back into results per recipe.
+    Imports are matched on the munki name, VirusTotal rows on the package file
+    of an import, failures on the recipe they name.
+    """
+    per_recipe = {
+        recipe: {"imported": [], "failed": [], "virus_total": []} for recipe in recipes
+    }
+    by_name = {recipe_name(recipe).lower(): recipe for recipe in recipes}
+    by_reference = {}
+    for recipe in recipes:
+        cache_key, entry = recipe_catalog.find(RECIPE_CATALOG, recipe)
+        references = {recipe, os.path.basename(recipe), cache_key}
+        references.add((entry or {}).get("identifier"))
+        references.add((entry or {}).get("file"))
+        for suffix in recipe_catalog.OVERRIDE_SUFFIXES:
+            references.add(os.path.basename(recipe).removesuffix(suffix))
+        for reference in references:
+            if reference:
+                by_reference[reference] = recipe
+    by_pkg = {}
+
+    def name_match(text):
+        """Find the recipe whose NAME a file name or munki name starts with."""
+        text = os.path.basename(str(text)).lower()
+        if text in by_name:
+            return by_name[text]
+        candidates = [name for name in by_name if name and text.startswith(name)]
+        if candidates:
+            return by_name[max(candidates, key=len)]
+        return None
+
+    for item in report_results["imported"]:
+        recipe = name_match(item.get("name", "")) or name_match(
+            item.get("pkg_repo_path", "")
+        )
+        if not recipe:
+            print(f"Could not match import {item.get('name')} to a recipe")
+            recipe = recipes[0]
+        per_recipe[recipe]["imported"].append(item)
+        if item.get("pkg_repo_path"):
+            by_pkg[os.path.basename(item["pkg_repo_path"])] = recipe
+    for item in report_results["virus_total"]:
+        recipe = by_pkg.get(os.path.basename(item.get("name", ""))) or name_match(
+            item.get("name", "")
+        )
+        if recipe:
+            per_recipe[recipe]["virus_total"].append(item)
+    for item in report_results["failed"]:
+        reference = str(item.get("recipe", ""))
+        recipe = by_reference.get(reference) or by_reference.get(
+            os.path.basename(reference)
+        )
+        if not recipe:
+            print(f"Could not match failure of {reference} to a recipe")
+            recipe = recipes[0]
+        per_recipe[recipe]["failed"].append(item)
+    return per_recipe
+
+
+def autopkg_verify_batch(recipes):
+    """
+    Verify the trust info of a chunk with one `autopkg verify-trust-info`,
+    falling back to recipe by recipe verification if any of them fails.
+    Returns recipe -> override of the trust info that was updated.
+    """
+    unverified = []
+    for recipe in recipes:
+        cache_key, entry = recipe_catalog.find(RECIPE_CATALOG, recipe)
+        fingerprint = trust_cache.fingerprint_trust(entry["sha256"], entry["trust"])
+        if trust_cache.is_verified(TRUST_CACHE, cache_key, fingerprint):
+            print(f"Trust info of {recipe} is unchanged, skipping verification")
+            continue
+        unverified.append((recipe, cache_key, fingerprint))
+    if not unverified:
+        return {}
+    verify_cmd = ["/usr/local/bin/autopkg", "verify-trust-info"]
+    verify_cmd.extend(recipe for recipe, _, _ in unverified)
+    verification_result = run_live(
+        verify_cmd,
+        recipe_log_path(batch_label(recipes)),
+        timeout=VERIFY_TIMEOUT * len(unverified),
+    )
+    if verification_result["success"]:
+        for recipe, cache_key, fingerprint in unverified:
+            trust_cache.record(TRUST_CACHE, TRUST_CACHE_PATH, cache_key, fingerprint)
+        return {}
+    trust_updated = {}
+    for recipe, _, _ in unverified:
+        override_path = autopkg_verify_update(recipe)
+        if override_path:
+            trust_updated[recipe] = override_path
+    return trust_updated
+
+
+def batch_label(recipes):
+    """Name a chunk of recipes after its first recipe and its size."""
+    return f"{os.path.basename(recipes[0])}+{len(recipes) - 1}"
+
+
+def run_batch(recipes, journal):
+    """
+    Run a chunk of recipes in one `autopkg run` through a recipe list and
+    return a dict of recipe -> results, the same results run_recipe returns.
+    """
+    if len(recipes) == 1:
+        return {recipes[0]: run_recipe(recipes[0], journal)}
+    label = batch_label(recipes)
+    with run_trace.span("batch", label, recipes=len(recipes)):
+        with run_trace.span("verify"):
+            trust_updated = autopkg_verify_batch(recipes)
+        for recipe in recipes:
+            run_journal.mark(journal, recipe, "verified")
+        recipe_list = os.path.join(REPORTS_DIR, f"{label}.txt")
+        with open(recipe_list, "w") as file:
+            file.write("\n".join(recipes) + "\n")
+        report_plist = report_plist_path(label)
+        if os.path.exists(report_plist):
+            os.remove(report_plist)
+        autopkg_cmd = ["/usr/local/bin/autopkg", "run", "-vvv"]
+        autopkg_cmd.extend(["--recipe-list", recipe_list])
+        autopkg_cmd.extend(["--report-plist", report_plist])
+        autopkg_cmd.append("--post")
+        autopkg_cmd.append(
+            "io.github.hjuutilainen.VirusTotalAnalyzer/VirusTotalAnalyzer"
+        )
+        with run_trace.span("autopkg run"):
+            result = run_live(
+                autopkg_cmd,
+                recipe_log_path(label),
+                timeout=RECIPE_TIMEOUT * len(recipes),
+            )
+        for recipe in recipes:
+            run_journal.mark(journal, recipe, "ran")
+        if not os.path.exists(report_plist):
+            batch_results = missing_report(recipes, result)
+        else:
+            with run_trace.span("parse report"):
+                batch_results = attribute_results(
+                    recipes, parse_report_plist(report_plist)
+                )
+        for recipe, override_path in trust_updated.items():
+            batch_results[recipe]["trust_updated"] = override_path
+        return batch_results
+
+
+def can_replay(journal, recipe):
+    """
+    Check if a journaled recipe can skip autopkg and only replay the
+    commit and push stages.
+    """
+    recipe_entry = run_journal.recipe_entry(journal, recipe)
+    if run_journal.reached(journal, recipe, "committed"):
+        return commit_exists(recipe_entry.get("commit"))
+    if run_journal.reached(journal, recipe, "parsed"):
+        imported = recipe_entry["results"]["imported"]
+        if not imported:
+            return True
+        # the pkginfo is only still around if we're on the same runner
+        pkginfo_path = imported[0].get("pkginfo_path")
+        return bool(pkginfo_path) and os.path.exists(
+            os.path.join(PKGSINFO_DIR, pkginfo_path)
+        )
+    return False
+
+
+def push_committed(branchname, journal, pending):
+    """
+    Push the commits of all pending recipes in one go and finish them up.
+    Returns a git_push style failure for every recipe that didn't make it.
+    """
+    if not pending:
+        return []
+    # Push to github
+    with run_trace.span("push", commits=len(pending)):
+        push_result = git_push(branchname)
+    failures = []
+    for recipe in pending:
+        if push_result["success"]:
+            # recipes with only a trust info commit didn't import anything
+            if run_journal.reached(journal, recipe, "committed"):
+                with run_trace.span("resolve issues", recipe):
+                    handle_existing_issue_on_success(recipe)
+            run_journal.mark(journal, recipe, "pushed")
+        else:
+            # stays committed in the journal, --resume pushes it again
+            print(f"Commit for {recipe} was not pushed to {branchname}")
+            failures.append(dict(push_result, recipe=recipe))
+    pending.clear()
+    return failures
+
+
+def handle_run_results(recipe, run_results, branchname, journal, pending):
+    """
+    Commit and file issues for the results of one recipe, the commits are
+    queued in pending and pushed with their batch. Updated trust info gets a
+    commit of its own, before the import.
+    Only ever called from the main thread, so the repo stays consistent.
+    """
+    recipe_entry = run_journal.recipe_entry(journal, recipe)
+    trust_updated = run_results.get("trust_updated")
+    if trust_updated and not commit_exists(recipe_entry.get("trust_commit")):
+        with run_trace.span("commit trust info", recipe):
+            trust_commit = commit_trust_update(recipe, trust_updated)
+        run_journal.mark(journal, recipe, trust_commit=trust_commit)
+    if run_results["failed"] and "issues" not in recipe_entry:
+        # create issue
+        issue_urls = []
+        with run_trace.span("file issues", recipe):
             for item in run_results["failed"]:
                 recipe_name = item["recipe"]
                 error_message = item["message"]
-                issue_URL = create_issue(recipe_name, error_message)
-                issues.append(issue_URL)
-        if run_results["imported"]:
+                issue_urls.append(create_issue(recipe_name, error_message))
+        run_journal.mark(journal, recipe, issues=issue_urls)
+    if run_results["imported"]:
+        if not run_journal.reached(journal, recipe, "committed"):
             # Commit changes
-            create_commit(run_results["imported"][0])
-            # Push to github
-            push_result = git_push(branchname)
-            if not push_result["success"]:
-                continue
+            with run_trace.span("commit", recipe):
+                create_commit(run_results["imported"][0])
+            run_journal.mark(journal, recipe, "committed", commit=head_commit())
+    elif not run_journal.recipe_entry(journal, recipe).get("trust_commit"):
+        run_journal.mark(journal, recipe, "pushed")
+        return
+    pending.append(recipe)
+    if PUSH_BATCH_SIZE and len(pending) >= PUSH_BATCH_SIZE:
+        push_committed(branchname, journal, pending)
+
+
+def precheck_recipes(recipes, journal):
+    """
+    Drop the recipes whose upstream didn't change since the last run,
+    they are journaled as done and skipped.
+    """
+    identifiers = {recipe: recipe_identifier(recipe) for recipe in recipes}
+    changed = upstream_check.changed_recipes(identifiers, AUTOPKG_CACHE_DIR)
+    nothing = {"imported": [], "failed": [], "virus_total": []}
+    for recipe in recipes:
+        if recipe not in changed:
+            run_journal.mark(journal, recipe, "pushed", results=nothing, skipped=True)
+    print(f"Pre-check: {len(changed)} of {len(recipes)} recipes changed upstream")
+    return [recipe for recipe in recipes if recipe in changed]
+
+
+def summarize_journal(journal):
+    """Collect the imported, failed, VirusTotal, issue and skipped lists for Slack."""
+    summary = {
+        "imported": [],
+        "failed": [],
+        "virus_total": [],
+        "issues": [],
+        "skipped": [],
+    }
+    for recipe, recipe_entry in journal["recipes"].items():
+        if recipe_entry.get("skipped"):
+            summary["skipped"].append(recipe)
+        run_results = recipe_entry.get("results")
+        if not run_results:
+            continue
+        if run_results["failed"]:
+            # Add to list of failed items
+            summary["failed"].append(run_results["failed"][0])
+            summary["issues"].extend(recipe_entry.get("issues", []))
+        if run_results["imported"] and run_journal.reached(journal, recipe, "pushed"):
+            imported_item = dict(run_results["imported"][0])
+            # Add basic item name to imported results so we can tell the difference between arm and intel items
+            imported_item["recipename"] = parse_recipe_name(recipe)
+            # Add to list of imported items
+            summary["imported"].append(imported_item)
+            # Add the VirusTotal link
+            virus_total_items = run_results["virus_total"]
+            if virus_total_items:
+                virus_total_item = virus_total_items[0]
+                permalink = virus_total_item.get("permalink")
+                summary["virus_total"].append(permalink)
             else:
-                # Add basic item name to imported results so we can tell the difference between arm and intel items
-                run_results["imported"][0]["recipename"] = recipename
-                # Add to list of imported items
-                imported.append(run_results["imported"][0])
-                # Add the VirusTotal link
-                virus_total_items = run_results["virus_total"]
-                if virus_total_items:
-                    virus_total_item = virus_total_items[0]
-                    permalink = virus_total_item.get("permalink")
-                    virus_total_results.append(permalink)
-                else:
-                    virus_total_results.append(None)
-                handle_existing_issue_on_success(recipe)
+                summary["virus_total"].append(None)
+    return summary
+
+
+def handle_recipes(resume=False):
+    today = date.today()
+    branchname = f"munkiapps_{today}"
+    journal = run_journal.load_journal(JOURNAL_PATH) if resume else None
+    if journal:
+        if run_journal.finished(journal):
+            print("The journaled run has finished already, nothing to resume.")
+            return
+        # Pick up the branch and recipe list of the interrupted run
+        branchname = journal["branch"]
+        recipes = list(journal["recipes"])
+        resume_feature_branch(branchname)
+    else:
+        if INPUT_RECIPES:
+            recipes = INPUT_RECIPES
+        else:
+            recipes = get_recipes()
+        # Create the new branch
+        branchname = create_feature_branch(branchname)
+        journal = run_journal.new_journal(JOURNAL_PATH, branchname, recipes)
+    # One bulk fetch of the issues instead of a search per recipe
+    with run_trace.span("issue index"):
+        load_issue_index()
+    # Start the timer
+    start_time = datetime.now()
+    # Sort out what is done, what only needs the git stages and what has to run
+    to_replay = []
+    to_run = []
+    for recipe in recipes:
+        if run_journal.reached(journal, recipe, "pushed"):
+            continue
+        if can_replay(journal, recipe):
+            to_replay.append(recipe)
+        else:
+            to_run.append(recipe)
+    if resume:
+        print(
+            f"Resuming {branchname}: {len(recipes) - len(to_replay) - len(to_run)} done, "
+            f"{len(to_replay)} to replay, {len(to_run)} to run"
+        )
+    if UPSTREAM_PRECHECK and to_run:
+        with run_trace.span("upstream pre-check"):
+            to_run = precheck_recipes(to_run, journal)
+    # Recipes that are committed locally but not pushed yet
+    pending = []
+    for recipe in to_replay:
+        recipe_entry = run_journal.recipe_entry(journal, recipe)
+        handle_run_results(
+            recipe, recipe_entry["results"], branchname, journal, pending
+        )
+    # Run the recipe (file) list, autopkg runs happen in the worker pool while
+    # git commits, pushes and issue updates stay serialized in this thread
+    batches = plan_batches(to_run)
+    print(
+        f"Running {len(to_run)} recipes in {len(batches)} autopkg run(s) "
+        f"with {AUTOPKG_WORKERS} worker(s)"
+    )
+    with ThreadPoolExecutor(max_workers=AUTOPKG_WORKERS) as executor:
+        futures = {
+            executor.submit(run_and_hash, batch, journal): batch for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                batch_results = future.result()
+            except Exception as e:
+                traceback.print_exc()
+                batch_results = {
+                    recipe: {
+                        "imported": [],
+                        "failed": [{"recipe": recipe, "message": str(e)}],
+                        "virus_total": [],
+                    }
+                    for recipe in batch
+                }
+            for recipe in batch:
+                run_results = batch_results[recipe]
+                # Parse the results from report plist
+                run_journal.mark(journal, recipe, "parsed", results=run_results)
+                handle_run_results(recipe, run_results, branchname, journal, pending)
+    # Push whatever is left of the last batch
+    push_committed(branchname, journal, pending)
+
+    summary = summarize_journal(journal)
+    imported = summary["imported"]
+    failed = summary["failed"]
+    issues = summary["issues"]
+    virus_total_results = summary["virus_total"]
 
     remove_munkitools_folder()
-    # Create the PR
-    pull_request(branchname)
-    # obtain the url from json output of gh
-    git_pr = pull_request_link(branchname)
-    # extract the pr from the function
-    pr_formatting = git_pr.get("stdout")
-    # output has extra characters, we remove those
-    pr_link = pr_formatting.decode("utf-8").replace("\n", "")
-    # we want the last item in the text
-    extract_pr = pr_link.split("/")
-    pr_number = extract_pr[-1]
+    with run_trace.span("pull request"):
+        # Create the PR
+        pull_request(branchname)
+        # obtain the url of the PR
+        pr_link = pull_request_link(branchname)
     # get duration of the AutoPkg run, convert to proper time format
     end_time = datetime.now()
     elapsed_time = end_time - start_time
@@ -671,10 +1372,39 @@ def handle_recipes():
     build_duration = f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}"
     # Send a report of what happened to slack
     slack_notification = format_slack_message(
-        imported, failed, pr_link, virus_total_results, build_duration, issues
+        imported,
+        failed,
+        pr_link,
+        virus_total_results,
+        build_duration,
+        issues,
+        summary["skipped"],
     )
-    post_to_slack(slack_notification)
+    with run_trace.span("slack"):
+        slack_status = post_to_slack(slack_notification)
+    notified = [
+        recipe for recipe in recipes if run_journal.reached(journal, recipe, "pushed")
+    ]
+    if slack_status is None:
+        # no webhook, there's nothing to deliver
+        mark_notified(journal, notified)
+    else:
+        slack_status.add_done_callback(partial(mark_notified, journal, notified))
 
 
 if __name__ == "__main__":
-    handle_recipes()
+    parser = argparse.ArgumentParser(
+        description="Run AutoPkg recipes and import the results into Munki."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the run recorded in the run journal instead of starting over",
+    )
+    args = parser.parse_args()
+    NOTIFIER.flush_spilled()
+    try:
+        handle_recipes(resume=args.resume)
+    finally:
+        run_trace.export(TRACE_DIR)
+        NOTIFIER.close()
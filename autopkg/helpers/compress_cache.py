@@ -3,29 +3,232 @@ Used for gathering up the json files that the URLDownloaderPython creates
 for each download.
 This helps speed up the AutoPkg runs, as we look for the json cache before
 proceeding with any application download, which is the normal behaviour.
+
+The archive is still a plain .tar.gz, `tar -xzf` extracts it, but every file is
+its own gzip member. The first member holds MANIFEST_NAME, a json manifest with
+the sha256, size and mtime of every file and where its member sits in the archive.
+When the previous archive is passed in, the members of unchanged files are copied
+over as they are and only new or changed files get compressed, spread over a
+thread pool. verify_snapshot() checks every member against the manifest.
+
+Usage:
+    compress_cache.py            create the archive, see the env variables below
+    compress_cache.py verify A   verify archive A
 """
 
+import gzip
+import hashlib
+import io
+import json
 import os
+import sys
 import tarfile
-import shutil
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_NAME = ".cache_manifest.json"
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+def list_cache_files(autopkg_directory):
+    """Return the archive name -> path of every .info.json in the Cache."""
+    cache_files = {}
+    cache_dir = os.path.join(autopkg_directory, "Cache")
+    for foldername, subfolders, filenames in os.walk(cache_dir):
+        for filename in filenames:
+            if filename.endswith(".info.json"):
+                file_path = os.path.join(foldername, filename)
+                arcname = os.path.relpath(file_path, autopkg_directory)
+                cache_files[arcname] = file_path
+    return dict(sorted(cache_files.items()))
+
+
+def tar_member(arcname, data, mtime):
+    """Compress a single tar entry, header and padded data, as a gzip member."""
+    info = tarfile.TarInfo(arcname)
+    info.size = len(data)
+    info.mtime = mtime
+    info.mode = 0o644
+    padding = b"\0" * (-len(data) % BLOCK_SIZE)
+    tar_bytes = info.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")
+    return gzip.compress(tar_bytes + data + padding, mtime=0)
+
+
+def read_manifest(archive_file):
+    """
+    Read the manifest from the first gzip member of an open archive.
+    Returns the manifest and the offset the file members are relative to.
+    """
+    archive_file.seek(0)
+    decompressor = zlib.decompressobj(wbits=31)
+    tar_bytes = b""
+    read = 0
+    while not decompressor.eof:
+        chunk = archive_file.read(64 * 1024)
+        if not chunk:
+            raise ValueError("archive ends inside the manifest")
+        read += len(chunk)
+        tar_bytes += decompressor.decompress(chunk)
+    data_start = read - len(decompressor.unused_data)
+    with tarfile.open(fileobj=io.BytesIO(tar_bytes + b"\0" * BLOCK_SIZE * 2)) as tar:
+        member = tar.next()
+        if not member or member.name != MANIFEST_NAME:
+            raise ValueError("archive has no manifest")
+        manifest = json.load(tar.extractfile(member))
+    return manifest, data_start
+
+
+def load_previous(previous_archive):
+    """Load the manifest of the previous archive, None if there's no usable one."""
+    if not previous_archive or not os.path.exists(previous_archive):
+        return None, 0
+    try:
+        with open(previous_archive, "rb") as archive_file:
+            return read_manifest(archive_file)
+    except (OSError, ValueError, zlib.error, tarfile.TarError) as e:
+        print(f"Previous archive can't be reused: {e}")
+        return None, 0
+
+
+def read_member(archive_file, data_start, entry):
+    """Read the compressed member of an entry from an open archive."""
+    archive_file.seek(data_start + entry["offset"])
+    return archive_file.read(entry["length"])
+
+
+def member_data(member):
+    """Decompress a member and return the file data inside its tar entry."""
+    tar_bytes = gzip.decompress(member)
+    info = tarfile.TarInfo.frombuf(tar_bytes[:BLOCK_SIZE], "utf-8", "surrogateescape")
+    return tar_bytes[BLOCK_SIZE : BLOCK_SIZE + info.size]
+
+
+def snapshot_entry(arcname, file_path):
+    """Read a cache file and return its data and manifest entry."""
+    with open(file_path, "rb") as file:
+        data = file.read()
+    return data, {
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "size": len(data),
+        "mtime": int(os.path.getmtime(file_path)),
+    }
+
+
+def create_tar_gz(
+    autopkg_directory,
+    tar_archive_name,
+    destination_directory,
+    previous_archive=None,
+    workers=None,
+    keep_missing=False,
+):
+    """
+    Write the snapshot of the Cache to destination_directory/tar_archive_name,
+    reusing the members of files that are unchanged in previous_archive.
+    With keep_missing, files of previous_archive that aren't on disk (because
+    only part of the cache was restored) are carried over instead of dropped.
+    """
+    archive_path = os.path.join(destination_directory, tar_archive_name)
+    previous, previous_start = load_previous(previous_archive)
+    previous_entries = (previous or {}).get("entries", {})
+    cache_files = list_cache_files(autopkg_directory)
+    entries = {}
+    members = {}
+    to_compress = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        snapshots = executor.map(
+            lambda item: snapshot_entry(*item), cache_files.items()
+        )
+        previous_file = open(previous_archive, "rb") if previous else None
+        try:
+            for arcname, (data, entry) in zip(cache_files, snapshots):
+                entries[arcname] = entry
+                old = previous_entries.get(arcname)
+                if old and all(old[key] == entry[key] for key in entry):
+                    members[arcname] = read_member(previous_file, previous_start, old)
+                else:
+                    to_compress.append((arcname, data, entry["mtime"]))
+            if keep_missing:
+                for arcname, old in previous_entries.items():
+                    if arcname not in entries:
+                        entries[arcname] = dict(old)
+                        members[arcname] = read_member(
+                            previous_file, previous_start, old
+                        )
+        finally:
+            if previous_file:
+                previous_file.close()
+        compressed = executor.map(lambda item: tar_member(*item), to_compress)
+        for (arcname, _, _), member in zip(to_compress, compressed):
+            members[arcname] = member
+    entries = dict(sorted(entries.items()))
+    offset = 0
+    for arcname, entry in entries.items():
+        entry["offset"] = offset
+        entry["length"] = len(members[arcname])
+        offset += entry["length"]
+    manifest = {"version": 1, "entries": entries}
+    manifest_member = tar_member(
+        MANIFEST_NAME, json.dumps(manifest, sort_keys=True).encode(), 0
+    )
+    tmp_path = f"{archive_path}.tmp"
+    with open(tmp_path, "wb") as archive_file:
+        archive_file.write(manifest_member)
+        for arcname in entries:
+            archive_file.write(members[arcname])
+        # end of archive marker
+        archive_file.write(gzip.compress(b"\0" * BLOCK_SIZE * 2, mtime=0))
+    os.replace(tmp_path, archive_path)
+    print(
+        f"Cache snapshot: {len(entries)} files, {len(to_compress)} compressed, "
+        f"{len(entries) - len(to_compress)} reused"
+    )
+    return archive_path
+
 
+def verify_snapshot(archive_path, workers=None):
+    """Check every member of an archive against its manifest entry."""
+    with open(archive_path, "rb") as archive_file:
+        manifest, data_start = read_manifest(archive_file)
+        entries = manifest["entries"]
+        members = [
+            (arcname, read_member(archive_file, data_start, entry))
+            for arcname, entry in entries.items()
+        ]
 
-def create_tar_gz(autopkg_directory, tar_archive_name, destination_directory):
-    autopkg_dir = os.path.join(autopkg_directory, "Cache")
-    os.chdir(autopkg_dir)
-    with tarfile.open(tar_archive_name, "w:gz") as tar_file:
-        for foldername, subfolders, filenames in os.walk("."):
-            for filename in filenames:
-                if filename.endswith(".info.json"):
-                    file_path = os.path.join(foldername, filename)
-                    arcname = os.path.relpath(file_path, autopkg_directory)
-                    tar_file.add(file_path, arcname=arcname)
+    def check(item):
+        arcname, member = item
+        try:
+            data = member_data(member)
+        except (OSError, EOFError, zlib.error, tarfile.TarError) as e:
+            return f"{arcname}: {e}"
+        if hashlib.sha256(data).hexdigest() != entries[arcname]["sha256"]:
+            return f"{arcname}: sha256 mismatch"
+        return None
 
-    shutil.move(tar_archive_name, os.path.join(destination_directory, tar_archive_name))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        errors = [error for error in executor.map(check, members) if error]
+    for error in errors:
+        print(f"Cache snapshot is broken: {error}")
+    print(f"Verified {len(entries)} files in {archive_path}")
+    return not errors
 
 
-autopkg_directory = os.environ.get("autopkg_dir")
-tar_archive_name = os.environ.get("archive_name")
-destination_directory = os.environ.get("GITHUB_WORKSPACE")
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["verify"]:
+        sys.exit(0 if verify_snapshot(sys.argv[2]) else 1)
+    autopkg_directory = os.environ.get("autopkg_dir")
+    tar_archive_name = os.environ.get("archive_name")
+    destination_directory = os.environ.get("GITHUB_WORKSPACE")
+    previous_archive = os.environ.get("previous_archive")
+    keep_missing = os.environ.get("keep_missing", "").lower() == "true"
 
-create_tar_gz(autopkg_directory, tar_archive_name, destination_directory)
+    archive_path = create_tar_gz(
+        autopkg_directory,
+        tar_archive_name,
+        destination_directory,
+        previous_archive,
+        keep_missing=keep_missing,
+    )
+    if not verify_snapshot(archive_path):
+        sys.exit(1)
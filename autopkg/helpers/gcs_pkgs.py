@@ -0,0 +1,149 @@
+"""
+Listing, checking and deleting the packages in the Munki GCS bucket.
+
+The bucket is listed per folder under the pkgs/ prefix, the folders concurrently,
+asking only for the name, size, md5Hash and crc32c of each blob. That listing is
+compared with munki_repo/pkgs_manifest.json (see pkg_manifest.py): the Clean Repo
+orphan check and the Sync Munki Repo check both use it instead of re-hashing or
+re-listing the packages. Deletes go out in batch requests of up to BATCH_SIZE.
+
+Every function takes the storage client as an argument, so an in-memory fake can
+stand in for google-cloud-storage.
+
+Usage: gcs_pkgs.py check BUCKET [--prefix pkgs/] [--manifest path] [--pkgsinfo path]
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+
+import pkg_manifest
+
+try:
+    from google.cloud import storage
+except ImportError:
+    storage = None
+
+DEFAULT_PREFIX = "pkgs/"
+PKG_SUFFIXES = (".pkg", ".dmg")
+# Deletes sent in one batch request, GCS allows up to 100
+BATCH_SIZE = 100
+FIELDS = "items(name,size,md5Hash,crc32c),prefixes,nextPageToken"
+
+
+def default_client():
+    if storage is None:
+        raise ImportError("google-cloud-storage is required to reach the bucket")
+    return storage.Client()
+
+
+def list_prefix(client, bucket_name, prefix, delimiter=None):
+    """
+    List the blobs under a prefix, fetching only the fields the manifest has.
+    Returns name -> {"size", "md5", "crc32c"} and the folder prefixes.
+    """
+    iterator = client.list_blobs(
+        bucket_name, prefix=prefix, delimiter=delimiter, fields=FIELDS
+    )
+    blobs = {
+        blob.name: {"size": blob.size, "md5": blob.md5_hash, "crc32c": blob.crc32c}
+        for blob in iterator
+    }
+    # prefixes is only filled in once the pages have been read
+    return blobs, sorted(getattr(iterator, "prefixes", None) or [])
+
+
+def list_packages(bucket_name, prefix=DEFAULT_PREFIX, client=None, workers=8):
+    """
+    Yield (name, {"size", "md5", "crc32c"}) of the .pkg/.dmg files under prefix.
+    The folders right under prefix are listed concurrently, each one paging
+    through its own listing.
+    """
+    client = client or default_client()
+    blobs, folders = list_prefix(client, bucket_name, prefix, delimiter="/")
+    yield from ((name, blob) for name, blob in blobs.items() if is_package(name))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(list_prefix, client, bucket_name, folder)
+            for folder in folders
+        ]
+        for future in as_completed(futures):
+            folder_blobs, _ = future.result()
+            yield from (
+                (name, blob) for name, blob in folder_blobs.items() if is_package(name)
+            )
+
+
+def is_package(name):
+    return name.endswith(PKG_SUFFIXES)
+
+
+def delete_blobs(bucket_name, blob_names, client=None, dry_run=True):
+    """
+    Delete blobs in batched requests of up to BATCH_SIZE deletes.
+    Returns the names that were deleted, or would be with dry_run.
+    """
+    if dry_run:
+        for name in blob_names:
+            print(f"Dry run, not deleting gs://{bucket_name}/{name}")
+        return list(blob_names)
+    client = client or default_client()
+    bucket = client.bucket(bucket_name)
+    deleted = []
+    for start in range(0, len(blob_names), BATCH_SIZE):
+        chunk = blob_names[start : start + BATCH_SIZE]
+        try:
+            with client.batch():
+                for name in chunk:
+                    bucket.delete_blob(name)
+        except Exception as e:
+            print(f"Error deleting {len(chunk)} blobs from {bucket_name}: {e}")
+            continue
+        deleted.extend(chunk)
+    return deleted
+
+
+def check(manifest, listing, prefix=DEFAULT_PREFIX):
+    """
+    Compare the manifest with a bucket listing of name -> blob fields.
+    Returns the packages the bucket is missing or holds with other content.
+    """
+    remote = {
+        name[len(prefix) :]: blob
+        for name, blob in listing.items()
+        if name.startswith(prefix)
+    }
+    result = pkg_manifest.compare(manifest, remote)
+    for pkg_repo_path in result["missing"]:
+        print(f"Missing from the bucket: {prefix}{pkg_repo_path}")
+    for pkg_repo_path in result["changed"]:
+        print(f"Different in the bucket: {prefix}{pkg_repo_path}")
+    return result
+
+
+if __name__ == "__main__":
+    workspace = os.environ.get("GITHUB_WORKSPACE", ".")
+    parser = argparse.ArgumentParser(description="Check the Munki bucket packages.")
+    parser.add_argument("command", choices=["check"])
+    parser.add_argument("bucket", help="name of the GCS bucket")
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX)
+    parser.add_argument(
+        "--manifest",
+        default=os.path.join(workspace, "munki_repo", pkg_manifest.MANIFEST_NAME),
+    )
+    parser.add_argument(
+        "--pkgsinfo", default=os.path.join(workspace, "munki_repo", "pkgsinfo")
+    )
+    args = parser.parse_args()
+    manifest = pkg_manifest.load_manifest(args.manifest)
+    # only the packages of pkginfo files that are still in the repo matter
+    pkg_manifest.prune(manifest, args.pkgsinfo)
+    listing = dict(list_packages(args.bucket, args.prefix))
+    result = check(manifest, listing, args.prefix)
+    print(
+        f"Bucket check: {len(manifest)} packages in the manifest, "
+        f"{len(result['missing'])} missing, {len(result['changed'])} different"
+    )
+    sys.exit(1 if result["missing"] or result["changed"] else 0)
@@ -4,14 +4,28 @@ You can add these to a github action env, otherwise your local env also works.
 
 Does not take into account any really complex manifest creations, but does accept
 optional_installs and additional_catalogs; which are typically used customizations.
+
+Bulk mode builds the manifests of many enrollments in one run:
+    generate_manifest.py --bulk enrollments.jsonl|enrollments.csv [--summary summary.json]
+Each row has serial, login, department, optional_installs and additional_catalogs
+(lists, or comma separated in a CSV). Rows are streamed, every manifest is rendered
+in memory and only written when its bytes differ from the file on disk. The summary
+lists the created, changed and unchanged serials, and the rows that failed to parse.
 """
 
+import argparse
+import csv
+import json
 import os
 import plistlib
-import requests
+import re
+import sys
+
+import okta_users
 
 OKTA_API_URL = os.environ.get("OKTA_DOMAIN")
 OKTA_API_TOKEN = os.environ.get("OKTA_API_TOKEN")
+OKTA = None
 
 
 def get_input_values():
@@ -28,31 +42,30 @@ def get_input_values():
     return display_name, group, optional_installs, additional_catalogs, serial
 
 
-def get_user_profile(display_name):
-    try:
-        headers = {"Authorization": f"SSWS {OKTA_API_TOKEN}"}
+def okta_client():
+    """The Okta client of this run, created on first use."""
+    global OKTA
+    if OKTA is None:
+        OKTA = okta_users.OktaClient(OKTA_API_URL, OKTA_API_TOKEN)
+    return OKTA
 
-        # Make a request to Okta to get user profile based on display name
-        response = requests.get(
-            f"https://{os.environ.get('OKTA_DOMAIN')}.okta.com/api/v1/users/{display_name}%40{os.environ.get('OKTA_DOMAIN')}.com",
-            headers=headers,
-        )
 
-        response.raise_for_status()
-        user_info = response.json()
+def get_user_profile(display_name, department=None):
+    try:
+        # a miss prefetches the whole department, the rest of a batch hits the cache
+        user_info = okta_client().get_user(
+            f"{display_name}@{OKTA_API_URL}.com", department
+        )
         if user_info:
-            user_id = user_info[0]["id"]
-            manager = user_info[0]["isManager"]
-
             # inspect user profile
             # e.g. check user group or other profile attributes
             # replace the following line with desired inspection and logic
-            user_profile = {}
+            user_profile = user_info["profile"]
 
             return user_profile
         else:
             return {}
-    except requests.exceptions.RequestException as e:
+    except okta_users.OktaError as e:
         print(f"Error while fetching user profile from Okta: {e}")
         return {}
 
@@ -64,6 +77,126 @@ def get_user_profile(display_name):
 #        manifest_dict["optional_installs"].append("thisOtherCoolApp")
 
 
+SERIAL_PATTERN = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+def split_list(value):
+    """Accept a list or a comma separated string, return a list."""
+    if isinstance(value, list):
+        return value
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def read_rows(enrollments_path):
+    """
+    Yield (row number, raw row) from a JSONL or CSV file, rows aren't parsed
+    here. A CSV row the reader can't split is yielded as its error.
+    """
+    with open(enrollments_path, "r", newline="") as file:
+        if not enrollments_path.endswith(".csv"):
+            for line_number, line in enumerate(file, 1):
+                if line.strip():
+                    yield line_number, line
+            return
+        rows = csv.DictReader(file)
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                row = ValueError(f"unreadable CSV row: {e}")
+            yield rows.line_num, row
+
+
+def parse_enrollment(row):
+    """Turn a raw JSONL line or CSV row into an enrollment, ValueError if it's bad."""
+    if isinstance(row, Exception):
+        raise row
+    if isinstance(row, str):
+        row = json.loads(row)
+    if not isinstance(row, dict):
+        raise ValueError("a row has to be an object")
+    try:
+        return {
+            "serial": (row.get("serial") or "").strip(),
+            "display_name": row.get("login") or "nobody",
+            "group": row.get("department") or "default",
+            "optional_installs": split_list(row.get("optional_installs")),
+            "additional_catalogs": split_list(row.get("additional_catalogs")),
+        }
+    except (AttributeError, TypeError) as e:
+        raise ValueError(f"unexpected value: {e}")
+
+
+def write_manifest(manifest_path, manifest_dict):
+    """
+    Write a manifest only if its bytes differ from the file on disk.
+    Returns "created", "changed" or "unchanged".
+    """
+    data = plistlib.dumps(manifest_dict)
+    try:
+        with open(manifest_path, "rb") as file:
+            if file.read() == data:
+                return "unchanged"
+        status = "changed"
+    except FileNotFoundError:
+        status = "created"
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, manifest_path)
+    return status
+
+
+def bulk(enrollments_path, manifests_dir):
+    """Build the manifest of every enrollment in a file, returns the summary."""
+    statuses = {}
+    errors = []
+    for line_number, row in read_rows(enrollments_path):
+        # a bad row is reported, it doesn't stop the rest of the batch
+        try:
+            enrollment = parse_enrollment(row)
+        except ValueError as e:
+            errors.append(f"row {line_number}: {e}")
+            continue
+        serial = enrollment["serial"]
+        if not SERIAL_PATTERN.match(serial):
+            errors.append(f"row {line_number}: invalid serial {serial!r}")
+            continue
+        manifest_dict = create_manifest(
+            enrollment["display_name"],
+            enrollment["group"],
+            enrollment["optional_installs"],
+            enrollment["additional_catalogs"],
+        )
+        # if "user_profile_check" in enrollment["group"]:
+        #    user_profile = get_user_profile(
+        #        enrollment["display_name"], enrollment["group"]
+        #    )
+        #    customize_manifest(manifest_dict, user_profile)
+        try:
+            status = write_manifest(os.path.join(manifests_dir, serial), manifest_dict)
+        except OSError as e:
+            errors.append(f"row {line_number}: {serial}: {e}")
+            continue
+        # a serial listed twice stays created if its first row created it
+        if statuses.get(serial) != "created":
+            statuses[serial] = status
+    summary = {
+        status: sorted(serial for serial, value in statuses.items() if value == status)
+        for status in ("created", "changed", "unchanged")
+    }
+    summary["errors"] = errors
+    print(
+        f"Manifests: {len(summary['created'])} created, {len(summary['changed'])} changed, "
+        f"{len(summary['unchanged'])} unchanged, {len(errors)} errors"
+    )
+    for error in errors:
+        print(f"Error: {error}")
+    return summary
+
+
 def update_or_create_manifest(
     manifest_path, display_name, group, optional_installs, additional_catalogs
 ):
@@ -84,16 +217,15 @@ def update_or_create_manifest(
 
         # if "user_profile_check" in group:
         #    # Further actions based on user profile
-        #    user_profile = get_user_profile(display_name)
+        #    user_profile = get_user_profile(display_name, group)
         #    # Customize manifest based on user profile
         #    customize_manifest(existing_manifest, user_profile)
 
-        # save
-        with open(manifest_path, "wb") as file:
-            plistlib.dump(existing_manifest, file)
+        # save, unless nothing changed
+        status = write_manifest(manifest_path, existing_manifest)
 
         if os.path.exists(manifest_path):
-            print(f"Manifest edited: {manifest_path}")
+            print(f"Manifest {status}: {manifest_path}")
         else:
             print(f"Error: Unable to edit the manifest.")
     except IOError as e:
@@ -142,7 +274,34 @@ def main():
     update_or_create_manifest(
         manifest_path, display_name, group, optional_installs, additional_catalogs
     )
+    if OKTA:
+        OKTA.save()
+
+
+def main_bulk(enrollments_path, summary_path=None):
+    manifests_dir = os.path.join(
+        os.environ.get("GITHUB_WORKSPACE", "."), "munki_repo", "manifests"
+    )
+    summary = bulk(enrollments_path, manifests_dir)
+    if OKTA:
+        OKTA.save()
+    if summary_path:
+        with open(summary_path, "w") as file:
+            json.dump(summary, file, indent=2)
+    if os.environ.get("GITHUB_OUTPUT"):
+        # the serials the PR, bucket upload and Slack message cover
+        with open(os.environ["GITHUB_OUTPUT"], "a") as file:
+            serials = " ".join(summary["created"] + summary["changed"])
+            file.write(f"SERIALS={serials}\n")
+    # rows with errors are reported, they don't hold back the rest of the batch
+    return 0 if summary["created"] or summary["changed"] or summary["unchanged"] else 1
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate Munki manifests.")
+    parser.add_argument("--bulk", help="JSONL or CSV file of enrollments")
+    parser.add_argument("--summary", help="write the bulk summary json here")
+    args = parser.parse_args()
+    if args.bulk:
+        sys.exit(main_bulk(args.bulk, args.summary))
     main()
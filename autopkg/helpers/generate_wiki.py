@@ -6,47 +6,120 @@ Currently looks for .sh/.py scripts and the first pythonic comment block,
 then categorizes them. You can see this on the Munki wiki page, depending on what they're used as.
 It also removes pages from the wiki that does not have a corresponding script in the repo.
 
+The walk skips .git, munki_repo, the wiki checkout and other folders without scripts.
+Script descriptions are cached by script content hash in PAGE_CACHE_PATH, pages and
+the sidebar are only written when their content changed and only the pages, sidebar
+and Munki.md are staged in the wiki repo. The cache is saved once the push went through.
+The GitHub API lookups go through http_cache.py, fresh responses aren't requested
+again and older ones are revalidated with their ETag. Release notes are only parsed
+for a release tag that wasn't seen before.
+
 Improvements needed, mainly shell related:
 - A proper check for shell style commenting
 - A proper check for docstrings, currently acts weird with some shell comments
 """
 
+import hashlib
+import json
 import os
 import re
 import requests
 import subprocess
-import shutil
 import sys
-
-
-def categorize_scripts(repo_directory):
+from concurrent.futures import ThreadPoolExecutor
+
+import http_cache
+
+PAGE_CACHE_PATH = os.path.join(
+    os.environ.get("GITHUB_WORKSPACE", "."), ".cache", "wiki_pages.json"
+)
+# seconds a GitHub API response is used without asking again, after that it's
+# revalidated with its ETag
+RELEASE_TTL = 3600
+TAGS_TTL = 600
+RELEASE_SECTIONS = re.compile(
+    r"#{2,}\s(Fixes|Other changes|Enhancements|Improvements|New features and improvements|New features)(.*?)(?=#{2,}|$)",
+    re.DOTALL,
+)
+# folders that never hold scripts worth documenting
+SKIP_DIRS = {".git", "munki_repo", "wiki", "__pycache__", "node_modules", ".cache"}
+# wiki subfolder of each script category
+CATEGORY_DIRS = {
+    "processor": "processors",
+    "regular": "scripts",
+    "test": "testers",
+    "munki": "munki",
+}
+
+
+def load_page_cache(cache_path=PAGE_CACHE_PATH):
+    try:
+        with open(cache_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_page_cache(page_cache, cache_path=PAGE_CACHE_PATH):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(page_cache, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, cache_path)
+
+
+def script_category(file_path):
+    if "processors" in file_path or "autopkg_tools" in file_path:
+        return "processor"
+    elif "test" in file_path or "local_tools" in file_path:
+        return "test"
+    elif (
+        "promoter" in file_path
+        or "MunkiCatalog" in file_path
+        or "manifest" in file_path
+        or "application" in file_path
+    ):
+        return "munki"
+    return "regular"
+
+
+def categorize_scripts(repo_directory, page_cache=None):
     processor_scripts = {}
     regular_scripts = {}
     test_scripts = {}
     munki_scripts = {}
-
-    for root, _, files in os.walk(repo_directory):
-        for file in files:
+    categories = {
+        "processor": processor_scripts,
+        "regular": regular_scripts,
+        "test": test_scripts,
+        "munki": munki_scripts,
+    }
+    # script content hash -> description, docstrings are only extracted when
+    # a script changed
+    descriptions = (page_cache or {}).setdefault("descriptions", {})
+    seen = set()
+
+    for root, dirs, files in os.walk(repo_directory):
+        dirs[:] = sorted(
+            d for d in dirs if d not in SKIP_DIRS and not d.startswith(".")
+        )
+        for file in sorted(files):
             if file.endswith((".sh", ".py")):
                 file_path = os.path.join(root, file)
-                with open(file_path, "r") as f:
-                    lines = f.read()
-                    description = extract_description(lines)
-                    if description:
-                        if "processors" in file_path or "autopkg_tools" in file_path:
-                            processor_scripts[file] = description
-                        elif "test" in file_path or "local_tools" in file_path:
-                            test_scripts[file] = description
-                        elif (
-                            "promoter" in file_path
-                            or "MunkiCatalog" in file_path
-                            or "manifest" in file_path
-                            or "application" in file_path
-                        ):
-                            munki_scripts[file] = description
-                        else:
-                            regular_scripts[file] = description
-
+                with open(file_path, "rb") as f:
+                    content = f.read()
+                content_hash = hashlib.sha256(content).hexdigest()
+                seen.add(content_hash)
+                if content_hash not in descriptions:
+                    descriptions[content_hash] = extract_description(
+                        content.decode("utf-8", "replace")
+                    )
+                description = descriptions[content_hash]
+                if description:
+                    categories[script_category(file_path)][file] = description
+
+    for content_hash in set(descriptions) - seen:
+        del descriptions[content_hash]
     return processor_scripts, regular_scripts, test_scripts, munki_scripts
 
 
@@ -63,10 +136,28 @@ def generate_markdown(description):
     return output
 
 
+def write_if_changed(path, content):
+    """Write content to path unless it already holds exactly that."""
+    try:
+        with open(path, "r") as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+    with open(path, "w") as f:
+        f.write(content)
+    return True
+
+
 def update_sidebar(
-    sidebar_path, processor_info, regular_info, test_scripts, munki_scripts
+    sidebar_source,
+    sidebar_path,
+    processor_info,
+    regular_info,
+    test_scripts,
+    munki_scripts,
 ):
-    with open(sidebar_path, "r") as fdesc:
+    with open(sidebar_source, "r") as fdesc:
         sidebar_content = fdesc.read()
 
     # wiki sidebar entries
@@ -94,8 +185,7 @@ def update_sidebar(
     for script_name in test_scripts:
         new_sidebar += f"    - [[{os.path.splitext(script_name)[0]}]]\n"
 
-    with open(sidebar_path, "w") as fdesc:
-        fdesc.write(new_sidebar)
+    return write_if_changed(sidebar_path, new_sidebar)
 
 
 def count_manifests(manifests_path):
@@ -105,7 +195,57 @@ def count_manifests(manifests_path):
     return num_manifests
 
 
-def gather_munki_info(workspace_directory, folder_path):
+def format_release_notes(release_notes_raw):
+    matches = RELEASE_SECTIONS.findall(release_notes_raw)
+    formatted_release_notes = []
+    fixes_section = None
+    other_changes_section = None
+    enhancements_section = None
+    improvements_section = None
+    features_and_improvements_section = None
+    new_features_section = None
+
+    for section, content in matches:
+        if section == "Fixes":
+            fixes_section = content
+        elif section == "Other changes":
+            other_changes_section = content
+        elif section == "Enhancements":
+            enhancements_section = content
+        elif section == "Improvements":
+            improvements_section = content
+        elif section == "New features and improvements":
+            features_and_improvements_section = content
+        elif section == "New features in version":
+            new_features_section = content
+
+    # check if sections are present and output them
+    if fixes_section:
+        formatted_release_notes.append(f"Fixes:\n{fixes_section}")
+
+    if other_changes_section:
+        formatted_release_notes.append(f"Other changes:\n{other_changes_section}")
+
+    if enhancements_section:
+        formatted_release_notes.append(f"Enhancements:\n{enhancements_section}")
+
+    if improvements_section:
+        formatted_release_notes.append(f"Improvements:\n{improvements_section}")
+
+    if features_and_improvements_section:
+        formatted_release_notes.append(
+            f"New features and improvements:\n{features_and_improvements_section}"
+        )
+
+    if new_features_section:
+        formatted_release_notes.append(
+            f"New features in version:\n{new_features_section}"
+        )
+
+    return "\n".join(formatted_release_notes)
+
+
+def gather_munki_info(workspace_directory, folder_path, http, notes_cache):
     # count the number of things in specific folders
     folder_full_path = os.path.join(workspace_directory, folder_path)
     folder_files = os.listdir(folder_full_path)
@@ -123,63 +263,21 @@ def gather_munki_info(workspace_directory, folder_path):
     releases_url = "https://api.github.com/repos/munki/munki/releases/latest"
     headers = {"Authorization": f'token {os.environ.get("GITHUB_TOKEN")}'}
     try:
-        response = requests.get(releases_url, headers=headers)
-        response.raise_for_status()
-        release_data = response.json()
+        release_data = http.get_json(releases_url, headers=headers, ttl=RELEASE_TTL)
         latest_release_tag = release_data["tag_name"]
-        release_notes_raw = release_data.get("body", "No release notes available.")
-        matches = re.findall(
-            r"#{2,}\s(Fixes|Other changes|Enhancements|Improvements|New features and improvements|New features)(.*?)(?=#{2,}|$)",
-            release_notes_raw,
-            re.DOTALL,
-        )
-        formatted_release_notes = []
-        fixes_section = None
-        other_changes_section = None
-        enhancements_section = None
-        improvements_section = None
-        features_and_improvements_section = None
-        new_features_section = None
-
-        for section, content in matches:
-            if section == "Fixes":
-                fixes_section = content
-            elif section == "Other changes":
-                other_changes_section = content
-            elif section == "Enhancements":
-                enhancements_section = content
-            elif section == "Improvements":
-                improvements_section = content
-            elif section == "New features and improvements":
-                features_and_improvements_section = content
-            elif section == "New features in version":
-                new_features_section = content
-
-        # check if sections are present and output them
-        if fixes_section:
-            formatted_release_notes.append(f"Fixes:\n{fixes_section}")
-
-        if other_changes_section:
-            formatted_release_notes.append(f"Other changes:\n{other_changes_section}")
-
-        if enhancements_section:
-            formatted_release_notes.append(f"Enhancements:\n{enhancements_section}")
-
-        if improvements_section:
-            formatted_release_notes.append(f"Improvements:\n{improvements_section}")
-
-        if features_and_improvements_section:
-            formatted_release_notes.append(
-                f"New features and improvements:\n{features_and_improvements_section}"
-            )
-
-        if new_features_section:
-            formatted_release_notes.append(
-                f"New features in version:\n{new_features_section}"
+        # the notes of a tag never change, only parse them for a new release
+        memo = notes_cache.get("release_notes", {})
+        if memo.get("tag") == latest_release_tag:
+            release_notes = memo["notes"]
+        else:
+            release_notes = format_release_notes(
+                release_data.get("body") or "No release notes available."
             )
-
-        release_notes = "\n".join(formatted_release_notes)
-        print(f"release notes formatted: {release_notes}")
+            notes_cache["release_notes"] = {
+                "tag": latest_release_tag,
+                "notes": release_notes,
+            }
+            print(f"release notes formatted: {release_notes}")
 
     except requests.exceptions.RequestException as e:
         latest_release_tag = "Unable to fetch latest release tag"
@@ -196,26 +294,21 @@ def gather_munki_info(workspace_directory, folder_path):
     )
 
 
-def get_latest_tag():
+def get_latest_tag(http):
     repo_url = f"https://api.github.com/repos/{os.environ['REPO_NAME']}/tags"
     github_headers = {
         "Content-Type": "application/json",
         "Authorization": f"token {os.environ.get('GITHUB_TOKEN')}",
     }
     try:
-        response = requests.get(repo_url, headers=github_headers)
-        if response.status_code == 200:
-            tags = response.json()
-            print(f"tags: {tags}")
-            # Ensure tags are not empty
-            if len(tags) > 0:
-                # The tags are sorted in descending order by default, so the first one is the latest
-                latest_tag = tags[0]["name"]
-                return latest_tag
-            else:
-                return None
+        tags = http.get_json(repo_url, headers=github_headers, ttl=TAGS_TTL)
+        print(f"tags: {tags}")
+        # Ensure tags are not empty
+        if len(tags) > 0:
+            # The tags are sorted in descending order by default, so the first one is the latest
+            latest_tag = tags[0]["name"]
+            return latest_tag
         else:
-            print(f"Failed to retrieve tags. Status code: {response.status_code}")
             return None
     except requests.exceptions.RequestException as e:
         print(f"Request error: {e}")
@@ -223,71 +316,65 @@ def get_latest_tag():
 
 
 def main(repo_directory):
-    (
-        processor_scripts,
-        regular_scripts,
-        test_scripts,
-        munki_scripts,
-    ) = categorize_scripts(repo_directory)
+    page_cache = load_page_cache()
+    scripts = categorize_scripts(repo_directory, page_cache)
+    processor_scripts, regular_scripts, test_scripts, munki_scripts = scripts
     wiki_repo_directory = os.path.join(os.environ["GITHUB_WORKSPACE"], "wiki")
-    sidebar_path = os.path.join(wiki_repo_directory, "_Sidebar.md")
-    if os.path.exists(sidebar_path):
-        os.remove(sidebar_path)
-
-    subprocess.run(["touch", os.path.join(wiki_repo_directory, "_Sidebar.md")])
     # create directories if they don't exist
-    for subdir in ["processors", "scripts", "testers", "munki"]:
+    for subdir in CATEGORY_DIRS.values():
         subdir_path = os.path.join(wiki_repo_directory, subdir)
         os.makedirs(subdir_path, exist_ok=True)
 
-    # Gather the list of existing wiki pages
-    existing_wiki_pages = set()
-    for root, _, files in os.walk(wiki_repo_directory):
-        for file in files:
-            if file.endswith(".md"):
-                existing_wiki_pages.add(os.path.splitext(file)[0])
-
-    # Check for wiki pages that no longer have corresponding scripts
-    for page_name in existing_wiki_pages:
-        if (
-            page_name not in processor_scripts
-            and page_name not in regular_scripts
-            and page_name not in test_scripts
-            and page_name not in munki_scripts
-        ):
-            # Delete the wiki page
-            wiki_page_path = os.path.join(
-                wiki_repo_directory, "processors", f"{page_name}.md"
-            )
-            if os.path.exists(wiki_page_path):
-                os.remove(wiki_page_path)
-            wiki_page_path = os.path.join(
-                wiki_repo_directory, "munki", f"{page_name}.md"
-            )
-            if os.path.exists(wiki_page_path):
-                os.remove(wiki_page_path)
-            wiki_page_path = os.path.join(
-                wiki_repo_directory, "scripts", f"{page_name}.md"
-            )
-            if os.path.exists(wiki_page_path):
-                os.remove(wiki_page_path)
-            wiki_page_path = os.path.join(
-                wiki_repo_directory, "testers", f"{page_name}.md"
+    # Pages every category folder should hold
+    expected_pages = {}
+    for category, category_scripts in zip(CATEGORY_DIRS, scripts):
+        subdir = CATEGORY_DIRS[category]
+        for script_name, description in category_scripts.items():
+            script_filename = f"{os.path.splitext(script_name)[0]}.md"
+            expected_pages[os.path.join(subdir, script_filename)] = generate_markdown(
+                description
             )
-            if os.path.exists(wiki_page_path):
-                os.remove(wiki_page_path)
+
+    # Remove the pages that no longer have a corresponding script, in one pass
+    removed = 0
+    for subdir in CATEGORY_DIRS.values():
+        for file in os.listdir(os.path.join(wiki_repo_directory, subdir)):
+            page_path = os.path.join(subdir, file)
+            if file.endswith(".md") and page_path not in expected_pages:
+                os.remove(os.path.join(wiki_repo_directory, page_path))
+                removed += 1
+
+    # Only write the pages whose docstring changed
+    written = 0
+    for page_path, script_doc in expected_pages.items():
+        if write_if_changed(os.path.join(wiki_repo_directory, page_path), script_doc):
+            written += 1
+    print(
+        f"Wiki pages: {len(expected_pages)} scripts, {written} written, {removed} removed"
+    )
 
     munki_info = ""
-    # gather Munki information
-    (
-        latest_release_tag,
-        num_files,
-        num_manifests,
-        num_apps,
-        munki_repo_link,
-        release_notes,
-    ) = gather_munki_info(repo_directory, os.path.join("autopkg", "RecipeOverrides"))
-    local_latest_release_tag = get_latest_tag()
+    # gather Munki information, both API lookups at once
+    http = http_cache.HttpCache()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        munki_future = executor.submit(
+            gather_munki_info,
+            repo_directory,
+            os.path.join("autopkg", "RecipeOverrides"),
+            http,
+            page_cache,
+        )
+        tag_future = executor.submit(get_latest_tag, http)
+        (
+            latest_release_tag,
+            num_files,
+            num_manifests,
+            num_apps,
+            munki_repo_link,
+            release_notes,
+        ) = munki_future.result()
+        local_latest_release_tag = tag_future.result()
+    http.save()
     release_notes = (
         f"""<br>
 
@@ -315,56 +402,39 @@ def main(repo_directory):
 """
 
     munki_md_path = os.path.join(wiki_repo_directory, "Munki.md")
-    if os.path.exists(munki_md_path):
-        os.remove(munki_md_path)
+    write_if_changed(munki_md_path, munki_info)
 
-    subprocess.run(["touch", os.path.join(wiki_repo_directory, "Munki.md")])
-    with open(munki_md_path, "w") as f:
-        f.write(munki_info)
-
-    sidebar_source = os.path.join(repo_directory, "_Sidebar.md")
-    sidebar_destination = os.path.join(wiki_repo_directory, "_Sidebar.md")
-    shutil.copyfile(sidebar_source, sidebar_destination)
-
-    sidebar_path = os.path.join(wiki_repo_directory, "_Sidebar.md")
+    # The sidebar is rendered every run, but only written when it changed
     update_sidebar(
-        sidebar_path, processor_scripts, regular_scripts, test_scripts, munki_scripts
+        os.path.join(repo_directory, "_Sidebar.md"),
+        os.path.join(wiki_repo_directory, "_Sidebar.md"),
+        processor_scripts,
+        regular_scripts,
+        test_scripts,
+        munki_scripts,
     )
 
-    for script_name, description in processor_scripts.items():
-        script_doc = generate_markdown(description)
-        script_filename = f"{os.path.splitext(script_name)[0]}.md"
-        script_path = os.path.join(wiki_repo_directory, "processors", script_filename)
-        with open(script_path, "w") as f:
-            f.write(script_doc)
-
-    for script_name, description in munki_scripts.items():
-        script_doc = generate_markdown(description)
-        script_filename = f"{os.path.splitext(script_name)[0]}.md"
-        script_path = os.path.join(wiki_repo_directory, "munki", script_filename)
-        with open(script_path, "w") as f:
-            f.write(script_doc)
-
-    for script_name, description in regular_scripts.items():
-        script_doc = generate_markdown(description)
-        script_filename = f"{os.path.splitext(script_name)[0]}.md"
-        script_path = os.path.join(wiki_repo_directory, "scripts", script_filename)
-        with open(script_path, "w") as f:
-            f.write(script_doc)
-
-    for script_name, description in test_scripts.items():
-        script_doc = generate_markdown(description)
-        script_filename = f"{os.path.splitext(script_name)[0]}.md"
-        script_path = os.path.join(wiki_repo_directory, "testers", script_filename)
-        with open(script_path, "w") as f:
-            f.write(script_doc)
-
-    os.chdir(wiki_repo_directory)
-    subprocess.run(["git", "add", "."])
+    # Only stage what this script manages, and only commit if something changed
     subprocess.run(
-        ["git", "commit", "-m", "Update script documentation and _Sidebar.md"]
+        ["git", "add", "-A", "--", "_Sidebar.md", "Munki.md"]
+        + list(CATEGORY_DIRS.values()),
+        cwd=wiki_repo_directory,
+        check=True,
     )
-    subprocess.run(["git", "push"])
+    staged = subprocess.run(
+        ["git", "diff", "--cached", "--quiet"], cwd=wiki_repo_directory
+    )
+    if staged.returncode == 0:
+        print("Wiki is up to date, nothing to push.")
+    else:
+        subprocess.run(
+            ["git", "commit", "-m", "Update script documentation and _Sidebar.md"],
+            cwd=wiki_repo_directory,
+            check=True,
+        )
+        subprocess.run(["git", "push"], cwd=wiki_repo_directory, check=True)
+    # a failed commit or push raised above, the next run starts from the old cache
+    save_page_cache(page_cache)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,249 @@
+"""
+Small GitHub REST API client for the issue, comment and pull request calls that
+autopkg_tools.py makes during an AutoPkg run.
+
+Everything goes through one keep-alive requests session with a connection pool, so
+there is no `gh` process or fresh TLS handshake per call. GET responses are cached
+by ETag and revalidated with If-None-Match, a 304 doesn't count against the rate limit.
+Results come back as small dataclasses instead of raw json.
+
+The API url defaults to GITHUB_API_URL (set by GitHub Actions), point it at a local
+stub server to test without touching GitHub.
+"""
+
+import os
+from dataclasses import dataclass
+from dataclasses import field
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import http_cache
+
+DEFAULT_API_URL = "https://api.github.com"
+
+
+class GitHubError(Exception):
+    """GitHub API exceptions."""
+
+
+@dataclass
+class Issue:
+    number: int
+    title: str
+    url: str
+    state: str
+    updated_at: str
+    created_at: str = ""
+    comment_count: int = 0
+    comment_authors: list = field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            number=data["number"],
+            title=data["title"],
+            url=data["html_url"],
+            # same casing as the gh cli uses
+            state=data["state"].upper(),
+            updated_at=data["updated_at"],
+            created_at=data.get("created_at", ""),
+            comment_count=data.get("comments", 0),
+        )
+
+
+@dataclass
+class Comment:
+    id: int
+    author: str
+    body: str
+    created_at: str
+    issue_number: int
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            id=data["id"],
+            author=(data.get("user") or {}).get("login", ""),
+            body=data.get("body", ""),
+            created_at=data.get("created_at", ""),
+            issue_number=int(data["issue_url"].rstrip("/").split("/")[-1]),
+        )
+
+
+@dataclass
+class PullRequest:
+    number: int
+    url: str
+    state: str
+    head: str
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            number=data["number"],
+            url=data["html_url"],
+            state=data["state"].upper(),
+            head=data["head"]["ref"],
+        )
+
+
+class GitHubClient:
+    """Pooled client for one repository."""
+
+    def __init__(
+        self,
+        repository,
+        token,
+        api_url=None,
+        pool_size=10,
+        timeout=30,
+    ):
+        self.repository = repository
+        self.api_url = (
+            api_url or os.environ.get("GITHUB_API_URL") or DEFAULT_API_URL
+        ).rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(
+            {
+                "Accept": "application/vnd.github+json",
+                "X-GitHub-Api-Version": "2022-11-28",
+            }
+        )
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        # only idempotent methods are retried, a POST could create an issue twice
+        retries = Retry(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=["GET", "PATCH"],
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # GET responses by url, revalidated with their ETag, for this run only
+        self.http = http_cache.HttpCache(
+            cache_path=None, session=self.session, stale_on_error=False
+        )
+
+    def repo_url(self, path):
+        return f"{self.api_url}/repos/{self.repository}/{path.lstrip('/')}"
+
+    def request(self, method, url, **kwargs):
+        """Send a request and raise GitHubError on anything but a 2xx/304."""
+        try:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            raise GitHubError(f"{method} {url} failed: {e}")
+        if response.status_code >= 400:
+            raise GitHubError(
+                f"{method} {url} failed: {response.status_code} {response.text}"
+            )
+        return response
+
+    def get(self, url, params=None):
+        """
+        GET a url, revalidating a cached response with its ETag.
+        Returns the json and the url of the next page, if any.
+        """
+        try:
+            entry = self.http.fetch(url, params=params, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            response = getattr(e, "response", None)
+            detail = f" {response.text}" if response is not None else ""
+            raise GitHubError(f"GET {url} failed: {e}{detail}")
+        return entry["data"], entry["next"]
+
+    def paginate(self, url, params=None):
+        """Yield every item of a paginated list endpoint."""
+        params = dict(params or {}, per_page=100)
+        while url:
+            data, url = self.get(url, params=params)
+            # the next link already carries the query string
+            params = None
+            yield from data
+
+    # Issues
+    def list_issues(self, state="open", since=None):
+        """List the issues (not pull requests) in a state, optionally updated since."""
+        params = {"state": state}
+        if since:
+            params["since"] = since
+        return [
+            Issue.from_json(item)
+            for item in self.paginate(self.repo_url("issues"), params)
+            if "pull_request" not in item
+        ]
+
+    def search_issues(self, title):
+        """Search the repository for issues by title."""
+        query = f'repo:{self.repository} is:issue in:title "{title}"'
+        data, _ = self.get(f"{self.api_url}/search/issues", params={"q": query})
+        return [Issue.from_json(item) for item in data.get("items", [])]
+
+    def list_comments(self, since=None):
+        """List the issue comments of the whole repository in bulk."""
+        params = {"sort": "created", "direction": "asc"}
+        if since:
+            params["since"] = since
+        return [
+            Comment.from_json(item)
+            for item in self.paginate(self.repo_url("issues/comments"), params)
+        ]
+
+    def list_issue_comments(self, number):
+        """List the comments of a single issue."""
+        return [
+            Comment.from_json(item)
+            for item in self.paginate(self.repo_url(f"issues/{number}/comments"))
+        ]
+
+    def create_issue(self, title, body):
+        response = self.request(
+            "POST", self.repo_url("issues"), json={"title": title, "body": body}
+        )
+        return Issue.from_json(response.json())
+
+    def add_comment(self, number, body):
+        response = self.request(
+            "POST", self.repo_url(f"issues/{number}/comments"), json={"body": body}
+        )
+        return Comment.from_json(response.json())
+
+    def set_issue_state(self, number, state, comment=None):
+        """Open or close an issue, commenting first like `gh issue close -c` does."""
+        if comment:
+            self.add_comment(number, comment)
+        response = self.request(
+            "PATCH", self.repo_url(f"issues/{number}"), json={"state": state}
+        )
+        return Issue.from_json(response.json())
+
+    def close_issue(self, number, comment=None):
+        return self.set_issue_state(number, "closed", comment)
+
+    def reopen_issue(self, number, comment=None):
+        return self.set_issue_state(number, "open", comment)
+
+    # Pull requests
+    def find_pull_request(self, head, state="open"):
+        """Return the pull request for a branch, if there is one."""
+        owner = self.repository.split("/")[0]
+        data, _ = self.get(
+            self.repo_url("pulls"), params={"head": f"{owner}:{head}", "state": state}
+        )
+        if data:
+            return PullRequest.from_json(data[0])
+        return None
+
+    def create_pull_request(self, head, base, title, body=""):
+        response = self.request(
+            "POST",
+            self.repo_url("pulls"),
+            json={"head": head, "base": base, "title": title, "body": body},
+        )
+        return PullRequest.from_json(response.json())
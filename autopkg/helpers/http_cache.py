@@ -0,0 +1,92 @@
+"""
+Small cache for GitHub API GET requests, the one ETag cache the helpers share.
+
+A response younger than its TTL is returned without any request. Older ones are
+revalidated with If-None-Match/If-Modified-Since, a 304 costs no rate limit and only
+refreshes the entry. Entries keep the json body and the url of the next page.
+
+With a cache_path the cache is one json file, written atomically by save(), and with
+stale_on_error the last cached response is used when the API can't be reached.
+Without a cache_path it only lives for the run (github_api.py). The cache is safe to
+share between threads.
+"""
+
+import json
+import os
+import threading
+import time
+import requests
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get("GITHUB_WORKSPACE", "."), ".cache", "http_cache.json"
+)
+
+
+class HttpCache:
+    def __init__(
+        self, cache_path=DEFAULT_CACHE_PATH, session=None, stale_on_error=True
+    ):
+        self.cache_path = cache_path
+        self.session = session or requests.Session()
+        self.stale_on_error = stale_on_error
+        self.lock = threading.Lock()
+        self.entries = {}
+        if cache_path:
+            try:
+                with open(cache_path, "r") as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError):
+                pass
+
+    def fetch(self, url, headers=None, params=None, ttl=0, timeout=30):
+        """
+        GET url and return its entry: {"data", "next", "etag", "last_modified",
+        "fetched"}. Raises requests exceptions, HTTPError for a 4xx/5xx.
+        """
+        url = requests.Request("GET", url, params=params).prepare().url
+        with self.lock:
+            cached = self.entries.get(url)
+        if cached and time.time() - cached["fetched"] < ttl:
+            return cached
+        headers = dict(headers or {})
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        try:
+            response = self.session.get(url, headers=headers, timeout=timeout)
+            if response.status_code == 304 and cached:
+                with self.lock:
+                    cached["fetched"] = time.time()
+                return cached
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            if not cached or not self.stale_on_error:
+                raise
+            print(f"{url}: {e}, using the cached response")
+            return cached
+        entry = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "next": response.links.get("next", {}).get("url"),
+            "fetched": time.time(),
+            "data": response.json(),
+        }
+        with self.lock:
+            self.entries[url] = entry
+        return entry
+
+    def get_json(self, url, headers=None, params=None, ttl=0, timeout=30):
+        """Return the json body of url, from the cache when it's still fresh."""
+        return self.fetch(url, headers, params, ttl, timeout)["data"]
+
+    def save(self):
+        if not self.cache_path:
+            return
+        with self.lock:
+            content = json.dumps(self.entries, indent=2, sort_keys=True)
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(content)
+        os.replace(tmp_path, self.cache_path)
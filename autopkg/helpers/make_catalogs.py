@@ -0,0 +1,183 @@
+"""
+Incremental replacement for `makecatalogs -s`.
+
+The pkginfo files under munki_repo/pkgsinfo are indexed by path with their mtime,
+size, sha256 and the pkginfo as it goes into the catalogs. A rebuild only reads
+files whose mtime or size changed and only parses the ones whose content changed,
+the catalogs are then assembled from the index. A catalog plist is only rewritten
+when its bytes changed, catalogs nothing refers to anymore are removed.
+
+Like makecatalogs it skips hidden files and folders, leaves out admin notes and
+keys starting with "_", puts every pkginfo in the "all" catalog and doesn't check
+for the installer items (-s). Items are ordered by pkginfo path.
+
+Usage: python3 make_catalogs.py munki_repo [--index path]
+"""
+
+import argparse
+import hashlib
+import os
+import plistlib
+
+DEFAULT_INDEX_PATH = os.path.join(
+    os.environ.get("GITHUB_WORKSPACE", "."), ".cache", "catalog_index.plist"
+)
+
+
+def load_index(index_path):
+    """Load the index, an unreadable index is an empty one."""
+    try:
+        with open(index_path, "rb") as file:
+            return plistlib.load(file)
+    except Exception:
+        return {}
+
+
+def save_index(index, index_path):
+    """Write the index atomically."""
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "wb") as file:
+        plistlib.dump(index, file, fmt=plistlib.FMT_BINARY)
+    os.replace(tmp_path, index_path)
+
+
+def catalog_pkginfo(content):
+    """Parse a pkginfo into what goes into the catalogs, None if it's not valid."""
+    pkginfo = plistlib.loads(content)
+    if not isinstance(pkginfo, dict) or "name" not in pkginfo:
+        return None
+    # don't copy admin notes or metadata to the catalogs
+    pkginfo.pop("notes", None)
+    for key in list(pkginfo):
+        if key.startswith("_"):
+            del pkginfo[key]
+    return pkginfo
+
+
+def list_pkgsinfo(pkgsinfo_dir):
+    """Return the relative paths of the pkginfo files, sorted."""
+    rel_paths = []
+    for root, dirs, files in os.walk(pkgsinfo_dir, followlinks=True):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        for file_name in files:
+            if file_name.startswith("."):
+                continue
+            rel_paths.append(
+                os.path.relpath(os.path.join(root, file_name), pkgsinfo_dir)
+            )
+    return sorted(rel_paths)
+
+
+def update_index(pkgsinfo_dir, index):
+    """Bring the index up to date with pkgsinfo_dir, returns the number parsed."""
+    parsed = 0
+    rel_paths = list_pkgsinfo(pkgsinfo_dir)
+    for rel_path in set(index) - set(rel_paths):
+        del index[rel_path]
+    for rel_path in rel_paths:
+        file_path = os.path.join(pkgsinfo_dir, rel_path)
+        stat = os.stat(file_path)
+        entry = index.get(rel_path)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            continue
+        with open(file_path, "rb") as file:
+            content = file.read()
+        sha256 = hashlib.sha256(content).hexdigest()
+        if not entry or entry["sha256"] != sha256:
+            try:
+                pkginfo = catalog_pkginfo(content)
+            except Exception as e:
+                print(f"Unexpected error reading {file_path}: {e}")
+                pkginfo = None
+            if pkginfo is None:
+                print(f"WARNING: {file_path} is not a valid pkginfo, skipping")
+            entry = {"pkginfo": pkginfo}
+            parsed += 1
+        entry.update({"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha256})
+        # plists have no null
+        if entry["pkginfo"] is None:
+            entry.pop("pkginfo")
+        index[rel_path] = entry
+    return parsed
+
+
+def assemble_catalogs(index, include=None):
+    """
+    Build the catalogs from the index as a dict of catalog name -> items,
+    only from the pkginfo paths in include if it's given.
+    """
+    catalogs = {"all": []}
+    for rel_path in sorted(index):
+        if include is not None and rel_path not in include:
+            continue
+        pkginfo = index[rel_path].get("pkginfo")
+        if pkginfo is None:
+            continue
+        catalogs["all"].append(pkginfo)
+        item_catalogs = pkginfo.get("catalogs") or []
+        if not item_catalogs:
+            print(f"WARNING: {rel_path} has no catalogs, it's only in 'all'")
+        for catalog in item_catalogs:
+            catalogs.setdefault(catalog, []).append(pkginfo)
+    return catalogs
+
+
+def write_catalogs(catalogs_dir, catalogs):
+    """
+    Write the catalogs whose bytes changed and remove the ones that are gone.
+    Returns the names of the written and removed catalogs.
+    """
+    os.makedirs(catalogs_dir, exist_ok=True)
+    written = []
+    for name, items in sorted(catalogs.items()):
+        data = plistlib.dumps(items)
+        catalog_path = os.path.join(catalogs_dir, name)
+        try:
+            with open(catalog_path, "rb") as file:
+                if file.read() == data:
+                    continue
+        except OSError:
+            pass
+        tmp_path = os.path.join(catalogs_dir, f".{name}.tmp")
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, catalog_path)
+        written.append(name)
+    removed = []
+    for name in sorted(os.listdir(catalogs_dir)):
+        if name.startswith(".") or name in catalogs:
+            continue
+        os.remove(os.path.join(catalogs_dir, name))
+        removed.append(name)
+    return written, removed
+
+
+def make_catalogs(repo_dir, index_path=DEFAULT_INDEX_PATH, include=None):
+    """
+    Rebuild the catalogs of a munki repo incrementally and return a summary.
+    include limits the catalogs to a set of pkginfo paths relative to pkgsinfo,
+    e.g. the ones git tracks while other imports are still writing theirs.
+    """
+    index = load_index(index_path)
+    parsed = update_index(os.path.join(repo_dir, "pkgsinfo"), index)
+    catalogs = assemble_catalogs(index, include)
+    written, removed = write_catalogs(os.path.join(repo_dir, "catalogs"), catalogs)
+    save_index(index, index_path)
+    print(
+        f"Catalogs: {len(index)} pkginfo files, {parsed} parsed, "
+        f"{len(written)} catalogs written, {len(removed)} removed"
+    )
+    return {"parsed": parsed, "written": written, "removed": removed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild the catalogs of a munki repo incrementally."
+    )
+    parser.add_argument("repo_dir", help="path to the munki repo")
+    parser.add_argument(
+        "--index", default=DEFAULT_INDEX_PATH, help="path of the pkginfo index"
+    )
+    args = parser.parse_args()
+    make_catalogs(args.repo_dir, args.index)
@@ -1,7 +1,11 @@
+import json
 import os
+import re
+import time
 from datetime import datetime, timezone, timedelta
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
+import notify
 
 """
 This python script handles the Slack result output of the Munki manifest creation or edits.
@@ -10,95 +14,234 @@ How it works:
 It sends one message with one Serial number to begin with.
 If there are more manifests being added (read: users onboarding one after another, which fires off the trigger),
 this first message gets each serial number added to it, instead of multiple Slack messages spamming a channel.
-It has a limit of an hour before sending a new message with a new serial number of the client enrolling.
+It has a limit of three hours before sending a new message with a new serial number of the client enrolling.
+
+The ts of that message is kept in THREAD_STATE_PATH, which the workflow caches, so an
+update only reads that one message for its current blocks before the chat.update,
+overlapping runs don't overwrite each other's lines with a stale copy. The channel
+history is only scanned when there's no usable state, and when the message can't be
+read or updated (deleted, say) its lines go into a new message. NEW_SERIAL may hold
+several serials, all of them, plus the lines of an update that failed earlier, go out
+together: the open message is filled up to Slack's MAX_BLOCKS and the rest is split
+over new messages of at most MAX_BLOCKS.
 """
 
+THREAD_STATE_PATH = os.path.join(
+    os.environ.get("GITHUB_WORKSPACE", "."), ".cache", "slack_enrollment.json"
+)
+THREAD_WINDOW = timedelta(hours=3)
+HEADER_TEXT = ":monkey: *New Munki Manifest(s)!*"
+# Slack refuses messages with more blocks
+MAX_BLOCKS = 50
+# lines of failed updates are retried for a day, the newest MAX_PENDING of them
+PENDING_TTL = 24 * 3600
+MAX_PENDING = 200
+
+
+def load_state(state_path=THREAD_STATE_PATH):
+    try:
+        with open(state_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, state_path=THREAD_STATE_PATH):
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def header_index(blocks):
+    """Index of the New Munki Manifest(s) section in blocks, None if missing."""
+    for index, block in enumerate(blocks):
+        if (
+            block["type"] == "section"
+            and "text" in block["text"]
+            and HEADER_TEXT in block["text"]["text"]
+        ):
+            return index
+    return None
+
+
+def find_message(client, channel, bot_id, now):
+    """
+    Scan the channel history for the bot's open message, returns its ts and
+    blocks.
+    """
+    response = client.conversations_history(
+        channel=channel,
+        oldest=(now - THREAD_WINDOW).timestamp(),
+        latest=now.timestamp(),
+    )
+    messages = response["messages"]
+    print(f"Scanned {len(messages)} messages for the manifest message")
+    for message in messages:
+        # find if a message from the bot exists in the messages variable
+        if "bot_id" in message and message["bot_id"] == bot_id:
+            blocks = message.get("blocks", [])
+            if header_index(blocks) is not None:
+                return message["ts"], blocks
+    return None, None
+
+
+def fetch_message(client, channel, ts):
+    """Read the current blocks of the message at ts, None if it's gone or changed."""
+    response = client.conversations_history(
+        channel=channel, oldest=ts, latest=ts, inclusive=True, limit=1
+    )
+    for message in response["messages"]:
+        blocks = message.get("blocks", [])
+        if message.get("ts") == ts and header_index(blocks) is not None:
+            return blocks
+    return None
+
+
+def serial_block(line):
+    return {"type": "context", "elements": [{"type": "mrkdwn", "text": line}]}
 
-def create_or_update_manifests():
+
+def header_block():
+    return {"type": "section", "text": {"type": "mrkdwn", "text": HEADER_TEXT}}
+
+
+def pending_lines(state):
+    """The lines of earlier failed updates that aren't too old, at most MAX_PENDING."""
+    now = time.time()
+    pending = [
+        entry
+        for entry in state.get("pending", [])
+        if isinstance(entry, dict) and now - entry["added"] < PENDING_TTL
+    ]
+    dropped = len(state.get("pending", [])) - len(pending)
+    if dropped:
+        print(f"Dropping {dropped} expired pending serial line(s)")
+    return pending[:MAX_PENDING]
+
+
+def api_result(future):
+    """The response of a dispatched Slack call, None if it failed."""
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"Slack call failed: {e}")
+        return None
+
+
+def create_or_update_manifests(dispatcher, state_path=THREAD_STATE_PATH):
     client = WebClient(token=os.environ["SLACK_BOT_TOKEN"])
+    channel = os.environ["CHANNEL_ID"]
     try:
         user_name = os.environ["LOGIN"]
         if os.environ["PR_NUMBER"]:
             pr_number = f"<https://github.com/{os.environ['REPO_NAME']}/pull/{os.environ['PR_NUMBER']}|{os.environ['PR_NUMBER']}>"
         else:
             pr_number = "No change needed"
-        # set times
+        serials = [
+            serial
+            for serial in re.split(r"[\s,]+", os.environ["NEW_SERIAL"].strip())
+            if serial
+        ]
+        state = load_state(state_path)
+        now = time.time()
+        # lines of an earlier update that didn't go through come along with this one
+        lines = [
+            {
+                "line": f":file_folder: Serial: {serial} :git: PR: {pr_number} :computer: {user_name}\n",
+                "added": now,
+            }
+            for serial in serials
+        ] + pending_lines(state)
         current_datetime_utc = datetime.now(timezone.utc)
-        three_hours_ago_utc = current_datetime_utc - timedelta(hours=3)
-        # check messages from 8am
-        response = client.conversations_history(
-            channel=os.environ["CHANNEL_ID"],
-            oldest=three_hours_ago_utc.timestamp(),
-            latest=current_datetime_utc.timestamp(),
-        )
-        messages = response["messages"]
-        print(f"messages: {messages}")
-        message_found = False
-        for message in messages:
-            # find if a message from the bot exists in the messages variable
-            if "bot_id" in message and message["bot_id"] == os.environ["BOT_ID"]:
-                print(f"bot id: {message['bot_id']}")
-                blocks = message.get("blocks", [])
-                # if the history includes a message with our search criteria
-                for block in blocks:
-                    if (
-                        block["type"] == "section"
-                        and "text" in block["text"]
-                        and ":monkey: *New Munki Manifest(s)!*" in block["text"]["text"]
-                    ):
-                        # we add an identical line to the first serial message
-                        new_serial_line = f":file_folder: Serial: {os.environ['NEW_SERIAL']} :git: PR: {pr_number} :computer: {user_name}\n"
-                        # keeping the block above in mind, we insert the json below right after it
-                        # with the above new_serial_line included
-                        blocks.insert(
-                            blocks.index(block) + 1,
-                            {
-                                "type": "context",
-                                "elements": [
-                                    {"type": "mrkdwn", "text": new_serial_line}
-                                ],
-                            },
-                        )
-                        # Update the message with modified blocks
-                        client.chat_update(
-                            channel=os.environ["CHANNEL_ID"],
-                            ts=message["ts"],
-                            blocks=blocks,
-                        )
-                        return f"Serial section added: {os.environ['NEW_SERIAL']}"
-                    elif not message_found:
-                        message_found = True
-
-        if not message_found:
-            # No message with the matching section found, create a new message
-            new_blocks = [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": ":monkey: *New Munki Manifest(s)!*",
-                    },
-                },
-                {
-                    "type": "context",
-                    "elements": [
-                        {
-                            "type": "mrkdwn",
-                            "text": f":file_folder: Serial: {os.environ['NEW_SERIAL']} :git: PR: {pr_number} :computer: {user_name}\n",
-                        }
-                    ],
-                },
+
+        ts = blocks = None
+        if (
+            state.get("channel") == channel
+            and state.get("ts")
+            and now - float(state["ts"]) < THREAD_WINDOW.total_seconds()
+        ):
+            # the blocks come fresh from Slack, another run may have added to
+            # the message since this state was cached
+            ts = state["ts"]
+            try:
+                blocks = fetch_message(client, channel, ts)
+            except SlackApiError as e:
+                print(f"Could not read message {ts}: {e}")
+                blocks = None
+            if blocks is None:
+                ts = None
+        if not ts:
+            try:
+                ts, blocks = find_message(
+                    client, channel, os.environ["BOT_ID"], current_datetime_utc
+                )
+            except SlackApiError as e:
+                print(f"Could not scan the channel history: {e}")
+                ts = blocks = None
+
+        # Fill the open message up to MAX_BLOCKS
+        if ts:
+            room = max(MAX_BLOCKS - len(blocks), 0)
+            chunk, lines = lines[:room], lines[room:]
+            if chunk:
+                # the new serial lines go right after the header, newest first
+                index = header_index(blocks)
+                updated = blocks[: index + 1] + [
+                    serial_block(entry["line"]) for entry in chunk
+                ]
+                updated += blocks[index + 1 :]
+                response = api_result(
+                    dispatcher.call_api(
+                        "chat.update",
+                        {"channel": channel, "ts": ts, "blocks": updated},
+                        spill=False,
+                    )
+                )
+                if not response:
+                    # the message may be gone, its lines go into a new one
+                    ts = None
+                    lines = chunk + lines
+
+        # the rest goes into new messages of at most MAX_BLOCKS blocks each
+        calls = []
+        while lines:
+            chunk, lines = lines[: MAX_BLOCKS - 1], lines[MAX_BLOCKS - 1 :]
+            new_blocks = [header_block()] + [
+                serial_block(entry["line"]) for entry in chunk
             ]
-            response = client.chat_postMessage(
-                channel=os.environ["CHANNEL_ID"], blocks=new_blocks
-            )
-            return f"Serial section created: {os.environ['NEW_SERIAL']}, Message created: {response['ts']}"
+            calls.append((new_blocks, chunk))
 
-        return "No matching message found."
+        futures = [
+            dispatcher.call_api(
+                "chat.postMessage",
+                {"channel": channel, "blocks": new_blocks},
+                spill=False,
+            )
+            for new_blocks, _ in calls
+        ]
+        pending = []
+        for (_, chunk), future in zip(calls, futures):
+            response = api_result(future)
+            if not response:
+                pending.extend(chunk)
+                continue
+            # the last message that went out is the one to add to next time
+            ts = response.get("ts")
+        # keep the lines, the next run adds them
+        save_state({"channel": channel, "ts": ts, "pending": pending}, state_path)
+        if pending:
+            return f"Error: Slack update failed, {len(pending)} serial line(s) pending"
+        return f"Serial section added: {', '.join(serials)}, Message: {ts}"
 
     except SlackApiError as e:
         return f"Error: {e}"
 
 
-result = create_or_update_manifests()
-print(result)
+if __name__ == "__main__":
+    dispatcher = notify.Dispatcher()
+    dispatcher.flush_spilled()
+    result = create_or_update_manifests(dispatcher)
+    dispatcher.close()
+    print(result)
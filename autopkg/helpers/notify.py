@@ -0,0 +1,232 @@
+"""
+Non-blocking Slack notifications.
+
+A Dispatcher takes notifications on a bounded queue and a background thread sends
+them with a timeout per request, retrying 429s, 5xx and connection errors with
+exponential backoff. Whatever can't be delivered, because the queue is full, the
+retries ran out or the run ended first, is appended to a spill file that the next
+run sends before anything else.
+
+A notification is a json job, either a webhook post:
+    {"kind": "webhook", "url_env": "SLACK_WEBHOOK", "payload": {...}}
+or a Slack Web API call:
+    {"kind": "api", "method": "chat.postMessage", "token_env": "SLACK_BOT_TOKEN",
+     "payload": {...}}
+Jobs name the env variable that holds the webhook url or token, never the secret
+itself, so the spill file is safe to cache between runs. Jobs with "spill": false
+are dropped instead of spilled.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import requests
+
+DEFAULT_SPILL_PATH = os.path.join(
+    os.environ.get("GITHUB_WORKSPACE", "."), ".cache", "notify_spill.jsonl"
+)
+SLACK_API_URL = "https://slack.com/api"
+
+
+class NotifyError(Exception):
+    """Notification delivery exceptions."""
+
+    def __init__(self, message, retry=False, retry_after=None):
+        super().__init__(message)
+        self.retry = retry
+        self.retry_after = retry_after
+
+
+def webhook_job(payload, url_env="SLACK_WEBHOOK"):
+    return {"kind": "webhook", "url_env": url_env, "payload": payload}
+
+
+def api_job(method, payload, token_env="SLACK_BOT_TOKEN", spill=True):
+    job = {"kind": "api", "method": method, "token_env": token_env, "payload": payload}
+    if not spill:
+        # callers that keep their own state don't want a stale replay
+        job["spill"] = False
+    return job
+
+
+def check_response(response):
+    """Raise NotifyError for a failed response, retryable if it's worth another try."""
+    if response.status_code == 429:
+        retry_after = float(response.headers.get("Retry-After", 1))
+        raise NotifyError("rate limited", retry=True, retry_after=retry_after)
+    if response.status_code >= 500:
+        raise NotifyError(f"{response.status_code}: {response.text}", retry=True)
+    if response.status_code >= 400:
+        raise NotifyError(f"{response.status_code}: {response.text}")
+
+
+class Dispatcher:
+    """Bounded queue of notifications with a background sender."""
+
+    def __init__(
+        self,
+        spill_path=DEFAULT_SPILL_PATH,
+        maxsize=100,
+        timeout=10,
+        retries=4,
+        backoff=1.0,
+        api_url=SLACK_API_URL,
+        session=None,
+    ):
+        self.spill_path = spill_path
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.api_url = api_url.rstrip("/")
+        self.session = session or requests.Session()
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.spill_lock = threading.Lock()
+        self.closing = threading.Event()
+        self.thread = threading.Thread(target=self.worker, name="notify", daemon=True)
+        self.thread.start()
+
+    def submit(self, job):
+        """
+        Queue a job without blocking. Returns a future with the Slack response,
+        or None if the job was spilled to disk instead.
+        """
+        future = Future()
+        try:
+            self.queue.put_nowait((job, future))
+        except queue.Full:
+            print("Notification queue is full, spilling to disk")
+            self.spill(job)
+            future.set_result(None)
+        return future
+
+    def post_webhook(self, payload, url_env="SLACK_WEBHOOK"):
+        return self.submit(webhook_job(payload, url_env))
+
+    def call_api(self, method, payload, token_env="SLACK_BOT_TOKEN", spill=True):
+        return self.submit(api_job(method, payload, token_env, spill))
+
+    def send(self, job):
+        """Send a job once, raising NotifyError if it failed."""
+        if job["kind"] == "webhook":
+            url = os.environ.get(job["url_env"])
+            if not url:
+                raise NotifyError(f"{job['url_env']} is not set")
+            try:
+                response = self.session.post(
+                    url, json=job["payload"], timeout=self.timeout
+                )
+            except requests.exceptions.RequestException as e:
+                raise NotifyError(str(e), retry=True)
+            check_response(response)
+            return {"ok": True, "status": response.status_code, "text": response.text}
+        token = os.environ.get(job["token_env"])
+        if not token:
+            raise NotifyError(f"{job['token_env']} is not set")
+        try:
+            response = self.session.post(
+                f"{self.api_url}/{job['method']}",
+                json=job["payload"],
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=self.timeout,
+            )
+        except requests.exceptions.RequestException as e:
+            raise NotifyError(str(e), retry=True)
+        check_response(response)
+        data = response.json()
+        if not data.get("ok"):
+            # Slack reports most errors with a 200
+            error = data.get("error", "unknown error")
+            raise NotifyError(error, retry=error in ("ratelimited", "internal_error"))
+        return data
+
+    def deliver(self, job):
+        """Send a job with retries, spill it and return None if it never went through."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self.send(job)
+            except NotifyError as e:
+                last_attempt = attempt == self.retries
+                if not e.retry or last_attempt or self.closing.is_set():
+                    print(f"Slack notification failed: {e}")
+                    if e.retry:
+                        self.spill(job)
+                    return None
+                delay = e.retry_after or self.backoff * 2**attempt
+                print(f"Slack notification failed: {e}, retrying in {delay:.0f}s")
+                if self.closing.wait(delay):
+                    # the run is ending, leave it to the next one
+                    self.spill(job)
+                    return None
+        return None
+
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            job, future = item
+            try:
+                future.set_result(self.deliver(job))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    def spill(self, job):
+        """Append a job to the spill file for the next run."""
+        if job.get("spill") is False:
+            return
+        with self.spill_lock:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            with open(self.spill_path, "a") as file:
+                file.write(json.dumps(job) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+
+    def flush_spilled(self):
+        """Queue the jobs a previous run spilled, returns how many there were."""
+        with self.spill_lock:
+            try:
+                with open(self.spill_path, "r") as file:
+                    lines = file.readlines()
+            except OSError:
+                return 0
+            os.remove(self.spill_path)
+        jobs = []
+        for line in lines:
+            try:
+                jobs.append(json.loads(line))
+            except ValueError:
+                continue
+        if jobs:
+            print(f"Sending {len(jobs)} notifications left over from an earlier run")
+        for job in jobs:
+            self.submit(job)
+        return len(jobs)
+
+    def close(self, timeout=60):
+        """
+        Wait up to timeout seconds for the queue to drain, then spill whatever is
+        still queued and stop the sender.
+        """
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+        # no more backoff sleeps, what fails from here on gets spilled
+        self.closing.set()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            job, future = item
+            self.spill(job)
+            future.set_result(None)
+            self.queue.task_done()
+        self.queue.put(None)
+        # a request already on the wire gets its own timeout to finish
+        self.thread.join(timeout=self.timeout + 1)
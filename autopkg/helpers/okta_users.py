@@ -0,0 +1,190 @@
+"""
+Okta user lookups for manifest customization.
+
+One keep-alive requests session with a connection pool serves every call, each with a
+timeout. Users are prefetched a page (up to 200) at a time, per department through a
+profile search or per group, and kept in a json cache with a TTL, so a batch of
+thousands of enrollments costs a few API pages instead of a request per user. The
+X-Rate-Limit-Remaining/-Reset headers are respected: a 429, or a nearly used up
+limit, waits for the reset before the next request.
+
+Only the id, status and PROFILE_FIELDS of a user are cached. The API url defaults to
+OKTA_BASE_URL or https://OKTA_DOMAIN.okta.com, point it at a local fake server to
+test without Okta.
+"""
+
+import json
+import os
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get("GITHUB_WORKSPACE", "."), ".cache", "okta_users.json"
+)
+# profile attributes manifests can be customized on
+PROFILE_FIELDS = ("login", "email", "department", "title", "isManager")
+DEFAULT_TTL = 12 * 3600
+PAGE_LIMIT = 200
+
+
+class OktaError(Exception):
+    """Okta API exceptions."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class OktaClient:
+    """Pooled, cached client for the Okta users API."""
+
+    def __init__(
+        self,
+        domain,
+        token,
+        api_url=None,
+        cache_path=DEFAULT_CACHE_PATH,
+        ttl=DEFAULT_TTL,
+        pool_size=4,
+        timeout=30,
+        retries=3,
+        min_remaining=2,
+    ):
+        self.api_url = (
+            api_url or os.environ.get("OKTA_BASE_URL") or f"https://{domain}.okta.com"
+        ).rstrip("/")
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.retries = retries
+        self.min_remaining = min_remaining
+        # departments and groups already prefetched in this run
+        self.prefetched = set()
+        self.session = requests.Session()
+        self.session.headers.update(
+            {"Accept": "application/json", "Authorization": f"SSWS {token}"}
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        try:
+            with open(cache_path, "r") as file:
+                self.cache = json.load(file)
+        except (OSError, ValueError):
+            self.cache = {}
+
+    def save(self):
+        """Write the user cache atomically, dropping expired users."""
+        now = time.time()
+        self.cache = {
+            login: entry
+            for login, entry in self.cache.items()
+            if now - entry["fetched"] < self.ttl
+        }
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.cache, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.cache_path)
+
+    def wait_for_reset(self, response):
+        """Sleep until the rate limit resets if it's used up, returns if it slept."""
+        remaining = response.headers.get("X-Rate-Limit-Remaining")
+        reset = response.headers.get("X-Rate-Limit-Reset")
+        if response.status_code != 429 and (
+            remaining is None or int(remaining) > self.min_remaining
+        ):
+            return False
+        delay = min(max(float(reset or 0) - time.time(), 0) + 1, 60)
+        print(f"Okta rate limit reached, waiting {delay:.0f}s")
+        time.sleep(delay)
+        return True
+
+    def request(self, url, params=None):
+        """GET a url, returns the response, waiting out the rate limit."""
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                raise OktaError(f"GET {url} failed: {e}")
+            self.wait_for_reset(response)
+            if response.status_code == 429 and attempt < self.retries:
+                continue
+            if response.status_code >= 400:
+                raise OktaError(
+                    f"GET {url} failed: {response.status_code} {response.text}",
+                    status=response.status_code,
+                )
+            return response
+        raise OktaError(f"GET {url} failed: rate limited", status=429)
+
+    def paginate(self, url, params=None):
+        """Yield every user of a paginated list endpoint, following the next links."""
+        params = dict(params or {}, limit=PAGE_LIMIT)
+        while url:
+            response = self.request(url, params=params)
+            # the next link already carries the query string
+            params = None
+            url = response.links.get("next", {}).get("url")
+            yield from response.json()
+
+    def store(self, user):
+        profile = user.get("profile", {})
+        login = (profile.get("login") or "").lower()
+        if not login:
+            return None
+        entry = {
+            "fetched": time.time(),
+            "id": user.get("id"),
+            "status": user.get("status"),
+            "profile": {field: profile.get(field) for field in PROFILE_FIELDS},
+        }
+        self.cache[login] = entry
+        return entry
+
+    def prefetch_department(self, department):
+        """Cache every user of a department, returns how many there were."""
+        if ("department", department) in self.prefetched:
+            return 0
+        self.prefetched.add(("department", department))
+        search = 'profile.department eq "{}"'.format(department.replace('"', '\\"'))
+        users = self.paginate(f"{self.api_url}/api/v1/users", {"search": search})
+        return sum(1 for user in users if self.store(user))
+
+    def prefetch_group(self, group_id):
+        """Cache every member of a group, returns how many there were."""
+        if ("group", group_id) in self.prefetched:
+            return 0
+        self.prefetched.add(("group", group_id))
+        users = self.paginate(f"{self.api_url}/api/v1/groups/{group_id}/users")
+        return sum(1 for user in users if self.store(user))
+
+    def cached(self, login):
+        entry = self.cache.get(login.lower())
+        if entry and time.time() - entry["fetched"] < self.ttl:
+            return entry
+        return None
+
+    def get_user(self, login, department=None):
+        """
+        Return the cached entry of a user, None if Okta doesn't know it.
+        With a department, a miss prefetches that whole department first.
+        """
+        entry = self.cached(login)
+        if entry:
+            return entry
+        if department:
+            self.prefetch_department(department)
+            entry = self.cached(login)
+            if entry:
+                return entry
+        try:
+            response = self.request(
+                f"{self.api_url}/api/v1/users/{requests.utils.quote(login)}"
+            )
+        except OktaError as e:
+            if e.status == 404:
+                return None
+            raise
+        return self.store(response.json())
@@ -0,0 +1,124 @@
+"""
+Sidecar manifest of the packages in munki_repo/pkgs.
+
+The pkgs folder isn't kept in git, so package identity had to be worked out again
+from the bucket or by hashing. autopkg_tools.py hashes every package right after
+it's imported and merges it into munki_repo/pkgs_manifest.json, which is committed
+with the pkginfo. Per package (keyed by its path under pkgs/) it records the size,
+sha256, md5 and crc32c, both base64 encoded the way GCS reports them, and the
+pkginfo that references it. crc32c needs google-crc32c, it's left out without it.
+
+The Clean Repo orphan check takes the packages of the pkginfo files in the manifest
+from referenced(), and compare() tells which packages a bucket listing is missing or
+has with different content; gcs_pkgs.py runs that check for Clean Repo and before
+Sync Munki Repo pushes the catalogs.
+"""
+
+import base64
+import hashlib
+import json
+import os
+
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
+MANIFEST_NAME = "pkgs_manifest.json"
+
+
+def hash_package(pkg_path):
+    """Hash a package in a single pass and return its manifest fields."""
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    crc32c = google_crc32c.Checksum() if google_crc32c else None
+    size = 0
+    with open(pkg_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            size += len(chunk)
+            sha256.update(chunk)
+            md5.update(chunk)
+            if crc32c:
+                crc32c.update(chunk)
+    hashes = {
+        "size": size,
+        "sha256": sha256.hexdigest(),
+        "md5": base64.b64encode(md5.digest()).decode(),
+    }
+    if crc32c:
+        hashes["crc32c"] = base64.b64encode(crc32c.digest()).decode()
+    return hashes
+
+
+def load_manifest(manifest_path):
+    """Load the manifest, a missing or unreadable one is empty."""
+    try:
+        with open(manifest_path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest, manifest_path):
+    """Write the manifest atomically, sorted so diffs stay small."""
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+        file.write("\n")
+    os.replace(tmp_path, manifest_path)
+
+
+def record(manifest, pkg_repo_path, hashes, pkginfo_path):
+    """Add or replace a package in the manifest."""
+    manifest[pkg_repo_path] = dict(hashes, pkginfo=pkginfo_path)
+
+
+def prune(manifest, pkgsinfo_dir):
+    """
+    Drop the packages whose pkginfo is gone or was never recorded, returns what
+    was dropped.
+    """
+    removed = []
+    for pkg_repo_path, entry in manifest.items():
+        pkginfo_path = entry.get("pkginfo")
+        if not pkginfo_path or not os.path.exists(
+            os.path.join(pkgsinfo_dir, pkginfo_path)
+        ):
+            removed.append(pkg_repo_path)
+    for pkg_repo_path in removed:
+        del manifest[pkg_repo_path]
+    return removed
+
+
+def referenced(manifest, pkgsinfo_dir):
+    """
+    Return the package file names referenced by pkginfo files that still exist,
+    and the relative paths of those pkginfo files.
+    """
+    packages = set()
+    pkginfo_paths = set()
+    for pkg_repo_path, entry in manifest.items():
+        pkginfo_path = entry.get("pkginfo")
+        if pkginfo_path and os.path.exists(os.path.join(pkgsinfo_dir, pkginfo_path)):
+            packages.add(os.path.basename(pkg_repo_path))
+            pkginfo_paths.add(pkginfo_path)
+    return packages, pkginfo_paths
+
+
+def compare(manifest, remote):
+    """
+    Compare the manifest to a remote listing of pkg path -> {"size", "md5"/"crc32c"}.
+    Returns the packages the remote is missing and the ones whose content differs.
+    """
+    missing = []
+    changed = []
+    for pkg_repo_path, entry in sorted(manifest.items()):
+        remote_entry = remote.get(pkg_repo_path)
+        if remote_entry is None:
+            missing.append(pkg_repo_path)
+            continue
+        for key in ("size", "md5", "crc32c"):
+            if key in entry and remote_entry.get(key) not in (None, entry[key]):
+                changed.append(pkg_repo_path)
+                break
+    return {"missing": missing, "changed": changed}
@@ -0,0 +1,106 @@
+"""
+Cached index of the pkginfo files in munki_repo/pkgsinfo.
+
+Per pkginfo it keeps the name, version, catalogs, installer_item_location and
+installer_item_hash, stored as json next to the other caches. Files with the same
+mtime and size as in the index aren't opened, files whose sha256 still matches (a
+fresh checkout resets every mtime) are only hashed, the rest is parsed again; when
+many files changed (a cold cache) they're parsed in a process pool. Helpers query
+the index instead of loading every plist themselves.
+"""
+
+import hashlib
+import json
+import os
+import plistlib
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_INDEX_PATH = os.path.join(
+    os.environ.get("GITHUB_WORKSPACE", "."), ".cache", "pkginfo_index.json"
+)
+FIELDS = ("name", "version", "catalogs", "installer_item_location")
+# below this many changed files a process pool costs more than it saves
+POOL_THRESHOLD = 64
+
+
+def file_sha256(file_path):
+    with open(file_path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def parse_pkginfo(file_path):
+    """Read the indexed fields of a pkginfo, None if it can't be parsed."""
+    try:
+        with open(file_path, "rb") as file:
+            pkginfo = plistlib.load(file)
+    except Exception as e:
+        print(f"Error parsing {file_path}: {e}")
+        return None
+    if not isinstance(pkginfo, dict):
+        return None
+    entry = {field: pkginfo.get(field) for field in FIELDS}
+    entry["hash"] = pkginfo.get("installer_item_hash")
+    return entry
+
+
+def load_index(pkgsinfo_dir, index_path=DEFAULT_INDEX_PATH, workers=None):
+    """Return the index of pkgsinfo_dir as relative path -> entry, refreshed."""
+    try:
+        with open(index_path, "r") as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        cached = {}
+    index = {}
+    changed = []
+    for root, dirs, files in os.walk(pkgsinfo_dir):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        for file_name in files:
+            if file_name.startswith(".") or not file_name.endswith(".plist"):
+                continue
+            file_path = os.path.join(root, file_name)
+            rel_path = os.path.relpath(file_path, pkgsinfo_dir)
+            stat = os.stat(file_path)
+            entry = cached.get(rel_path)
+            if (
+                entry
+                and entry["mtime"] == stat.st_mtime
+                and entry["size"] == stat.st_size
+            ):
+                index[rel_path] = entry
+                continue
+            # a fresh checkout touches every mtime, the content hash tells
+            # which files really changed
+            sha256 = file_sha256(file_path)
+            if entry and entry.get("sha256") == sha256:
+                index[rel_path] = dict(entry, mtime=stat.st_mtime, size=stat.st_size)
+            else:
+                changed.append((rel_path, file_path, stat, sha256))
+    paths = [file_path for _, file_path, _, _ in changed]
+    if len(changed) >= POOL_THRESHOLD:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = list(executor.map(parse_pkginfo, paths, chunksize=32))
+    else:
+        parsed = [parse_pkginfo(file_path) for file_path in paths]
+    for (rel_path, _, stat, sha256), entry in zip(changed, parsed):
+        if entry is None:
+            continue
+        entry.update({"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha256})
+        index[rel_path] = entry
+    index = dict(sorted(index.items()))
+    if index != cached:
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(index, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, index_path)
+    print(f"Pkginfo index: {len(index)} files, {len(changed)} parsed")
+    return index
+
+
+def installer_items(index):
+    """Return the file names of the installer items the pkginfo files reference."""
+    return {
+        os.path.basename(entry["installer_item_location"])
+        for entry in index.values()
+        if entry.get("installer_item_location")
+    }
@@ -0,0 +1,135 @@
+"""
+Cached catalog of the recipe overrides in autopkg/RecipeOverrides.
+
+For every override it keeps the identifier, NAME, ParentRecipe, ARCH, the trust info
+hashes and the AutoPkg repos the parents come from. The catalog is stored as json
+and refreshed against the overrides folder: files with the same mtime and size are
+taken as they are, files with a new mtime are hashed and only parsed again when
+their content actually changed. autopkg_tools.py and tests/test_actions.py both
+query it instead of walking and parsing every override themselves.
+"""
+
+import hashlib
+import json
+import os
+import plistlib
+import re
+import yaml
+
+DEFAULT_CATALOG_PATH = os.path.join(
+    os.environ.get("GITHUB_WORKSPACE", "."), ".cache", "recipe_catalog.json"
+)
+OVERRIDE_SUFFIXES = (".recipe", ".recipe.yaml")
+
+
+def extract_repo_from_path(path):
+    if "com.github.autopkg" in path:
+        # Extract everything after "com.github.autopkg." but before the next "/"
+        repo_name_match = re.search(r"com\.github\.autopkg\.([a-zA-Z0-9.-]+)", path)
+        if repo_name_match:
+            return repo_name_match.group(1)
+    return ""
+
+
+def parse_override(file_path, content):
+    """Pull the catalog fields out of a plist or yaml override."""
+    if file_path.endswith(".yaml"):
+        override = yaml.safe_load(content) or {}
+    else:
+        override = plistlib.loads(content)
+    override_input = override.get("Input") or {}
+    trust_info = override.get("ParentRecipeTrustInfo") or {}
+    repos = set()
+    for section in ("parent_recipes", "non_core_processors"):
+        for info in (trust_info.get(section) or {}).values():
+            repo_name = extract_repo_from_path(info.get("path", ""))
+            if repo_name:
+                repos.add(repo_name)
+    return {
+        "identifier": override.get("Identifier"),
+        "name": override_input.get("NAME"),
+        "parent_recipe": override.get("ParentRecipe"),
+        "arch": override_input.get("ARCH"),
+        "trust": {
+            section: trust_info.get(section) or {}
+            for section in ("parent_recipes", "non_core_processors")
+        },
+        "repos": sorted(repos),
+    }
+
+
+def load_catalog(overrides_dir, catalog_path=DEFAULT_CATALOG_PATH):
+    """
+    Return the catalog of overrides_dir as a dict of relative path -> entry,
+    re-parsing only what changed since the catalog was written.
+    """
+    try:
+        with open(catalog_path, "r") as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        cached = {}
+    catalog = {}
+    parsed = 0
+    for root, dirs, files in os.walk(overrides_dir):
+        for file_name in sorted(files):
+            if not file_name.endswith(OVERRIDE_SUFFIXES):
+                continue
+            file_path = os.path.join(root, file_name)
+            rel_path = os.path.relpath(file_path, overrides_dir)
+            stat = os.stat(file_path)
+            entry = cached.get(rel_path)
+            if (
+                entry
+                and entry["mtime"] == stat.st_mtime
+                and entry["size"] == stat.st_size
+            ):
+                catalog[rel_path] = entry
+                continue
+            with open(file_path, "rb") as override_file:
+                content = override_file.read()
+            sha256 = hashlib.sha256(content).hexdigest()
+            if not entry or entry["sha256"] != sha256:
+                try:
+                    entry = parse_override(file_path, content)
+                except Exception as e:
+                    print(f"Error reading {file_path}: {e}")
+                    continue
+                parsed += 1
+            entry.update(
+                {
+                    "file": file_name,
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size,
+                    "sha256": sha256,
+                }
+            )
+            catalog[rel_path] = entry
+    if catalog != cached:
+        os.makedirs(os.path.dirname(catalog_path) or ".", exist_ok=True)
+        tmp_path = f"{catalog_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(catalog, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, catalog_path)
+    print(f"Recipe catalog: {len(catalog)} overrides, {parsed} parsed")
+    return catalog
+
+
+def find(catalog, recipe):
+    """
+    Find the relative path and entry of a recipe as it's passed to autopkg,
+    a file name with or without its suffix. Returns (None, None) if unknown.
+    """
+    names = {recipe} | {f"{recipe}{suffix}" for suffix in OVERRIDE_SUFFIXES}
+    for rel_path, entry in catalog.items():
+        if entry["file"] in names or rel_path in names:
+            return rel_path, entry
+    return None, None
+
+
+def source_repos(catalog, suffixes=OVERRIDE_SUFFIXES):
+    """Return the AutoPkg repos that the overrides with the given suffixes use."""
+    repos = set()
+    for entry in catalog.values():
+        if entry["file"].endswith(suffixes):
+            repos.update(entry["repos"])
+    return repos
@@ -0,0 +1,122 @@
+"""
+Latest release download URL and SHA256 for the tools the workflows pin.
+
+Workflows install munkitools and AutoPkg from a pinned url with a checksum
+(MUNKI_URL/MUNKI_SHA256, AUTOPKG_URL/AUTOPKG_SHA256). test_actions.py checks every
+workflow against the latest release, this module makes that one lookup per tool
+per run instead of one per workflow file:
+- the releases/latest response is memoized and revalidated with its ETag, through
+  the shared http_cache.py
+- the .pkg is hashed while it streams in, in 1 MB chunks, unless the release
+  API already reports its sha256 digest
+- hashes are stored on disk keyed by asset url and ETag, so an unchanged asset
+  is never downloaded again
+"""
+
+import hashlib
+import json
+import os
+import threading
+import requests
+
+import http_cache
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get("GITHUB_WORKSPACE", "."), ".cache", "release_pins.json"
+)
+# env variable prefix in the workflows -> GitHub repository
+PINS = {"MUNKI": "munki/munki", "AUTOPKG": "autopkg/autopkg"}
+
+SESSION = requests.Session()
+HTTP = http_cache.HttpCache(session=SESSION)
+PINS_LOCK = threading.Lock()
+# repository -> pin, for the rest of the run
+LATEST = {}
+
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, "r") as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        cache = {}
+    # releases/latest now lives in http_cache.py
+    cache.pop("releases", None)
+    cache.setdefault("hashes", {})
+    return cache
+
+
+def save_cache(cache, cache_path):
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(cache, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, cache_path)
+
+
+def latest_release(repository, token):
+    """Fetch releases/latest, revalidated with its ETag through http_cache."""
+    url = f"https://api.github.com/repos/{repository}/releases/latest"
+    headers = {"Accept": "application/vnd.github+json"}
+    if token:
+        headers["Authorization"] = f"token {token}"
+    return HTTP.get_json(url, headers=headers, timeout=30)
+
+
+def stream_sha256(url):
+    """Download url in chunks and return its sha256."""
+    sha256 = hashlib.sha256()
+    with SESSION.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=1024 * 1024):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def asset_etag(url):
+    """Return the ETag of a download, None if the server sends none."""
+    try:
+        response = SESSION.head(url, allow_redirects=True, timeout=30)
+    except requests.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+    return response.headers.get("ETag")
+
+
+def asset_sha256(asset, cache):
+    """Return the sha256 of a release asset, downloading it only if needed."""
+    digest = asset.get("digest") or ""
+    if digest.startswith("sha256:"):
+        return digest.split(":", 1)[1]
+    url = asset["browser_download_url"]
+    etag = asset_etag(url)
+    # without an ETag, the asset id and update time tell if it was replaced
+    key = f"{url}|{etag or (asset.get('id'), asset.get('updated_at'))}"
+    if key not in cache["hashes"]:
+        cache["hashes"][key] = stream_sha256(url)
+    return cache["hashes"][key]
+
+
+def latest_pin(repository, token, cache_path=DEFAULT_CACHE_PATH):
+    """
+    Return {"url", "sha256"} of the .pkg in the latest release of repository,
+    or None if it has none. Looked up once per run.
+    """
+    with PINS_LOCK:
+        if repository in LATEST:
+            return LATEST[repository]
+        cache = load_cache(cache_path)
+        data = latest_release(repository, token)
+        pin = None
+        for asset in data.get("assets", []):
+            if asset["name"].endswith(".pkg"):
+                pin = {
+                    "url": asset["browser_download_url"],
+                    "sha256": asset_sha256(asset, cache),
+                }
+                break
+        save_cache(cache, cache_path)
+        HTTP.save()
+        LATEST[repository] = pin
+        return pin
@@ -0,0 +1,108 @@
+"""
+Restores the AutoPkg cache archive written by compress_cache.py.
+
+With recipes given, only the Cache/<identifier> folders of those recipes are
+extracted, found through the manifest at the start of the archive, so a run of
+one or two recipes doesn't unpack the whole cache. Without recipes every file is
+restored, decompressed on a thread pool and checked against its sha256. Archives
+from before the manifest existed are extracted as a whole with tarfile.
+
+Usage: restore_cache.py ARCHIVE DESTINATION [--recipes RECIPE ...]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tarfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import compress_cache
+import recipe_catalog
+
+RECIPE_DIR = os.path.join(
+    os.environ.get("GITHUB_WORKSPACE", "."), "autopkg", "RecipeOverrides"
+)
+
+
+def recipe_prefixes(recipes, overrides_dir=RECIPE_DIR):
+    """Return the Cache folders of the recipes, None if one can't be resolved."""
+    catalog = recipe_catalog.load_catalog(overrides_dir)
+    prefixes = []
+    for recipe in recipes:
+        _, entry = recipe_catalog.find(catalog, recipe)
+        if not entry or not entry.get("identifier"):
+            print(f"No identifier found for {recipe}, restoring everything")
+            return None
+        prefixes.append(f"Cache/{entry['identifier']}/")
+    return prefixes
+
+
+def restore_file(destination, arcname, entry, member):
+    """Decompress, verify and write a single cache file."""
+    data = compress_cache.member_data(member)
+    if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+        raise ValueError(f"{arcname}: sha256 mismatch")
+    file_path = os.path.join(destination, arcname)
+    if not os.path.realpath(file_path).startswith(os.path.realpath(destination)):
+        raise ValueError(f"{arcname}: outside of {destination}")
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as file:
+        file.write(data)
+    # upstream_check.py goes by the age of the .info.json files
+    os.utime(file_path, (entry["mtime"], entry["mtime"]))
+    return arcname
+
+
+def restore_cache(archive_path, destination, recipes=None, workers=None):
+    """Restore the cache of recipes, or all of it, returns the number of files."""
+    prefixes = recipe_prefixes(recipes) if recipes else None
+    with open(archive_path, "rb") as archive_file:
+        try:
+            manifest, data_start = compress_cache.read_manifest(archive_file)
+        except (ValueError, zlib.error, tarfile.TarError):
+            manifest = None
+        if manifest is None:
+            print(f"{archive_path} has no manifest, extracting all of it")
+            with tarfile.open(archive_path, "r:gz") as tar:
+                tar.extractall(destination)
+            return None
+        entries = {
+            arcname: entry
+            for arcname, entry in manifest["entries"].items()
+            if prefixes is None or arcname.startswith(tuple(prefixes))
+        }
+        members = [
+            (arcname, compress_cache.read_member(archive_file, data_start, entry))
+            for arcname, entry in entries.items()
+        ]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(
+            executor.map(
+                lambda item: restore_file(
+                    destination, item[0], entries[item[0]], item[1]
+                ),
+                members,
+            )
+        )
+    print(
+        f"Restored {len(entries)} of {len(manifest['entries'])} cache files"
+        + (f" for {len(recipes)} recipes" if prefixes is not None else "")
+    )
+    return len(entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Restore the AutoPkg cache archive.")
+    parser.add_argument("archive", help="archive written by compress_cache.py")
+    parser.add_argument("destination", help="folder holding the AutoPkg Cache")
+    parser.add_argument(
+        "--recipes", nargs="*", help="only restore the cache of these recipes"
+    )
+    args = parser.parse_args()
+    try:
+        restore_cache(args.archive, args.destination, args.recipes)
+    except (OSError, ValueError, zlib.error, tarfile.TarError) as e:
+        print(f"Restoring the cache failed: {e}")
+        sys.exit(1)
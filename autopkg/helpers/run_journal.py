@@ -0,0 +1,85 @@
+"""
+Crash-safe journal for AutoPkg runs.
+
+autopkg_tools.py records how far every recipe got (verified, ran, parsed, committed,
+pushed, notified) together with its report data in a JSON file. The file is
+rewritten atomically after every change, so a runner that times out or dies leaves
+a usable journal behind. Running `autopkg_tools.py --resume` reads it back, skips
+the recipes that are done and only replays the commit, push and Slack stages
+that are still pending.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+from datetime import timezone
+
+# The order matters, a recipe in a later state has passed all earlier ones.
+# Recipes that had nothing to commit go straight from "parsed" to "pushed".
+STATES = ["pending", "verified", "ran", "parsed", "committed", "pushed", "notified"]
+
+# Worker threads update the journal while the main thread commits
+JOURNAL_LOCK = threading.Lock()
+
+
+def new_journal(path, branchname, recipes):
+    """Start a fresh journal for a run on branchname and write it to path."""
+    journal = {
+        "path": path,
+        "branch": branchname,
+        "started": datetime.now(timezone.utc).isoformat(),
+        "recipes": {recipe: {"state": "pending"} for recipe in recipes},
+    }
+    save_journal(journal)
+    return journal
+
+
+def load_journal(path):
+    """Load the journal at path, returns None if there is no usable journal."""
+    try:
+        with open(path, "r") as file:
+            journal = json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"No run journal to resume from at {path}: {e}")
+        return None
+    journal["path"] = path
+    return journal
+
+
+def save_journal(journal):
+    """Write the journal atomically, a crash never leaves half a file behind."""
+    path = journal["path"]
+    tmp_path = f"{path}.tmp"
+    with JOURNAL_LOCK:
+        with open(tmp_path, "w") as file:
+            json.dump(journal, file, indent=2, default=str)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+
+def mark(journal, recipe, state=None, **data):
+    """Move a recipe to state (if given), store any extra data with it and persist."""
+    with JOURNAL_LOCK:
+        current = journal["recipes"].setdefault(recipe, {"state": "pending"})
+        if state:
+            current["state"] = state
+        current.update(data)
+    save_journal(journal)
+
+
+def reached(journal, recipe, state):
+    """Check if the recipe has gotten to state (or further) in the journal."""
+    state_index = STATES.index(recipe_entry(journal, recipe)["state"])
+    return state_index >= STATES.index(state)
+
+
+def recipe_entry(journal, recipe):
+    """Return the journal entry of a recipe."""
+    return journal["recipes"].get(recipe, {"state": "pending"})
+
+
+def finished(journal):
+    """Check if every recipe in the journal has been notified about."""
+    return all(reached(journal, recipe, "notified") for recipe in journal["recipes"])
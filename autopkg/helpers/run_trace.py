@@ -0,0 +1,129 @@
+"""
+Timing spans for AutoPkg runs.
+
+autopkg_tools.py wraps every phase (trust verification, autopkg run, report parsing,
+commits, pushes, GitHub API calls, Slack) and every subprocess in a span. At the
+end of the run the spans are written as:
+- trace.json, a Chrome trace that opens in Perfetto or chrome://tracing
+- recipes.csv, the time every recipe spent in each phase
+- summary.txt, the slowest recipes and phases, which is also printed to the log
+"""
+
+import csv
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+EVENTS = []
+EVENTS_LOCK = threading.Lock()
+START = time.perf_counter()
+# the recipe a thread is working on, nested spans are attributed to it
+CURRENT = threading.local()
+
+
+@contextmanager
+def span(name, recipe=None, **args):
+    """Time the block as a span, attributed to recipe or the thread's recipe."""
+    outer_recipe = getattr(CURRENT, "recipe", None)
+    recipe = recipe or outer_recipe
+    CURRENT.recipe = recipe
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        CURRENT.recipe = outer_recipe
+        with EVENTS_LOCK:
+            EVENTS.append(
+                {
+                    "name": name,
+                    "recipe": recipe,
+                    "start": start - START,
+                    "duration": end - start,
+                    "thread": threading.current_thread().name,
+                    "args": args,
+                }
+            )
+
+
+def export_chrome_trace(path):
+    """Write the spans in the Chrome trace event format."""
+    threads = {}
+    trace_events = []
+    for event in EVENTS:
+        tid = threads.setdefault(event["thread"], len(threads) + 1)
+        trace_events.append(
+            {
+                "name": event["name"],
+                "cat": "recipe" if event["recipe"] else "run",
+                "ph": "X",
+                "ts": round(event["start"] * 1_000_000),
+                "dur": round(event["duration"] * 1_000_000),
+                "pid": 1,
+                "tid": tid,
+                "args": dict(event["args"], recipe=event["recipe"]),
+            }
+        )
+    for thread_name, tid in threads.items():
+        trace_events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 1,
+                "tid": tid,
+                "args": {"name": thread_name},
+            }
+        )
+    with open(path, "w") as file:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file)
+
+
+def recipe_phases():
+    """Sum up the time of every (recipe, phase) pair."""
+    totals = {}
+    for event in EVENTS:
+        if not event["recipe"]:
+            continue
+        key = (event["recipe"], event["name"])
+        count, seconds = totals.get(key, (0, 0.0))
+        totals[key] = (count + 1, seconds + event["duration"])
+    return totals
+
+
+def export_recipe_csv(path):
+    """Write the time every recipe spent in each phase as csv."""
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["recipe", "phase", "count", "seconds"])
+        for (recipe, phase), (count, seconds) in sorted(recipe_phases().items()):
+            writer.writerow([recipe, phase, count, f"{seconds:.3f}"])
+
+
+def summary(top=10):
+    """Return the slowest recipes and phases as text."""
+    recipes = {}
+    phases = {}
+    for event in EVENTS:
+        phases[event["name"]] = phases.get(event["name"], 0.0) + event["duration"]
+        if event["name"] == "recipe":
+            recipes[event["recipe"]] = event["duration"]
+    lines = [f"Slowest recipes (top {top}):"]
+    for recipe, seconds in sorted(recipes.items(), key=lambda x: -x[1])[:top]:
+        lines.append(f"  {seconds:9.1f}s  {recipe}")
+    lines.append(f"Slowest phases, summed over all recipes (top {top}):")
+    for phase, seconds in sorted(phases.items(), key=lambda x: -x[1])[:top]:
+        lines.append(f"  {seconds:9.1f}s  {phase}")
+    return "\n".join(lines)
+
+
+def export(trace_dir):
+    """Write trace.json, recipes.csv and summary.txt into trace_dir."""
+    os.makedirs(trace_dir, exist_ok=True)
+    export_chrome_trace(os.path.join(trace_dir, "trace.json"))
+    export_recipe_csv(os.path.join(trace_dir, "recipes.csv"))
+    run_summary = summary()
+    with open(os.path.join(trace_dir, "summary.txt"), "w") as file:
+        file.write(run_summary + "\n")
+    print(run_summary)
@@ -0,0 +1,146 @@
+"""
+Subprocess runner that streams output instead of collecting it.
+
+stdout and stderr are read line by line while the command runs. Every line is
+appended to an optional log file and, if asked, echoed to the console. Only the
+last tail_lines lines of each stream are kept in memory for error messages and
+issue bodies, so `autopkg run -vvv` on a chatty recipe doesn't grow the wrapper.
+stdout can still be captured whole for commands whose output gets parsed (git).
+
+Commands run in a session of their own, so a timeout kills the whole process
+group, children like curl or installer included, and not just the command.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+from collections import deque
+
+# longest line read in one go, a line without newlines can't fill the memory
+MAX_LINE = 64 * 1024
+
+
+def pump(pipe, tail, buffer_lock, log, log_lock, echo, capture):
+    """Copy a pipe line by line into the tail buffer, log, console and capture."""
+    for line in iter(lambda: pipe.readline(MAX_LINE), b""):
+        with buffer_lock:
+            tail.append(line)
+            if capture is not None:
+                capture.append(line)
+        if log:
+            with log_lock:
+                if not log.closed:
+                    log.write(line)
+        if echo:
+            echo.buffer.write(line)
+            echo.flush()
+    pipe.close()
+
+
+def kill_group(proc, sig):
+    """Send sig to the process group of proc, if it's still around."""
+    try:
+        os.killpg(proc.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def run(
+    cmd,
+    cwd=None,
+    log_path=None,
+    timeout=None,
+    tail_lines=200,
+    echo=False,
+    capture_stdout=False,
+):
+    """
+    Run cmd and return a dict with its status, success, stdout and stderr as
+    bytes and timed_out. stderr (and stdout unless capture_stdout) only holds the
+    last tail_lines lines. A command that runs past timeout seconds is killed.
+    """
+    log = None
+    if log_path:
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        log = open(log_path, "ab")
+        log.write(f"$ {' '.join(str(arg) for arg in cmd)}\n".encode())
+    log_lock = threading.Lock()
+    # the pumps may outlive a timed out command, the buffers are read under it
+    buffer_lock = threading.Lock()
+    stdout_tail = deque(maxlen=tail_lines)
+    stderr_tail = deque(maxlen=tail_lines)
+    stdout_all = [] if capture_stdout else None
+    timed_out = False
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            start_new_session=True,
+        )
+        pumps = [
+            threading.Thread(
+                target=pump,
+                args=(
+                    proc.stdout,
+                    stdout_tail,
+                    buffer_lock,
+                    log,
+                    log_lock,
+                    sys.stdout if echo else None,
+                    stdout_all,
+                ),
+            ),
+            threading.Thread(
+                target=pump,
+                args=(
+                    proc.stderr,
+                    stderr_tail,
+                    buffer_lock,
+                    log,
+                    log_lock,
+                    sys.stderr if echo else None,
+                    None,
+                ),
+            ),
+        ]
+        for thread in pumps:
+            thread.start()
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            kill_group(proc, signal.SIGTERM)
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                pass
+            # anything that ignored SIGTERM, children included, holds the pipes
+            kill_group(proc, signal.SIGKILL)
+            proc.wait()
+        except BaseException:
+            # the command's session doesn't get the terminal's Ctrl-C
+            kill_group(proc, signal.SIGKILL)
+            raise
+        for thread in pumps:
+            # a child that left the process group can still hold a pipe
+            thread.join(timeout=10 if timed_out else None)
+    finally:
+        if log:
+            with log_lock:
+                log.close()
+    with buffer_lock:
+        stdout = b"".join(stdout_all if capture_stdout else stdout_tail)
+        stderr = b"".join(stderr_tail)
+    if timed_out:
+        stderr += f"Timed out after {timeout} seconds\n".encode()
+    return {
+        "stdout": stdout,
+        "stderr": stderr,
+        "status": proc.returncode,
+        "success": proc.returncode == 0 and not timed_out,
+        "timed_out": timed_out,
+    }
@@ -0,0 +1,82 @@
+"""
+Cache of recipe overrides that passed `autopkg verify-trust-info`.
+
+An override is fingerprinted by its own content hash plus the git_hash/sha256_hash
+of every parent recipe and processor in its ParentRecipeTrustInfo. The parents are
+checked against the recipe repos that are checked out on the runner, so a
+fingerprint only exists while every parent still matches what the override trusts.
+autopkg_tools.py skips verification when the fingerprint is the same as the last
+time the override verified. Any change to the override or a parent file changes
+(or voids) the fingerprint and verification runs again.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+# Worker threads verify recipes at the same time
+CACHE_LOCK = threading.Lock()
+
+
+def file_sha256(path):
+    """Return the sha256 hash of a file."""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def fingerprint_trust(override_sha256, trust_info):
+    """
+    Fingerprint an override from its sha256 and the trust info recipe_catalog.py
+    parsed from it. Returns None if a parent is missing from the checked-out
+    recipe repos or no longer matches the hash the override trusts, verification
+    has to run then.
+    """
+    digest = hashlib.sha256()
+    digest.update(override_sha256.encode())
+    for section in ("parent_recipes", "non_core_processors"):
+        for name, info in sorted((trust_info.get(section) or {}).items()):
+            parent_path = os.path.expanduser(info.get("path", ""))
+            if not os.path.isfile(parent_path):
+                return None
+            if file_sha256(parent_path) != info.get("sha256_hash"):
+                return None
+            recorded = (info.get("git_hash"), info.get("sha256_hash"))
+            digest.update(f"{section}:{name}:{recorded}".encode())
+    return digest.hexdigest()
+
+
+def load_cache(path):
+    """Load the cache from path, an unreadable cache is an empty one."""
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache, path):
+    """Write the cache atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(cache, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_verified(cache, key, override_fingerprint):
+    """Check if the override verified before with the same fingerprint."""
+    return bool(override_fingerprint) and cache.get(key) == override_fingerprint
+
+
+def record(cache, path, key, override_fingerprint):
+    """Remember a successful verification and persist the cache."""
+    with CACHE_LOCK:
+        if override_fingerprint:
+            cache[key] = override_fingerprint
+        else:
+            cache.pop(key, None)
+        save_cache(cache, path)
@@ -0,0 +1,137 @@
+"""
+Pre-flight check for upstream changes before autopkg runs a recipe.
+
+URLDownloaderPython leaves a `<download>.info.json` next to every file it downloads
+in the AutoPkg Cache (the same files compress_cache.py archives), with the url and
+the ETag/Last-Modified the server sent. For every recipe we send a conditional
+HEAD request (GET if the server refuses HEAD) per cached download, all of them
+concurrently, and only recipes where something changed, or where we can't tell,
+get queued for a full `autopkg run`.
+
+A recipe that resolves a new download url for every release (GitHub releases and
+the like) still answers "unchanged" for the old url, so downloads older than
+max_age_days are always treated as changed. That bounds how long a new version
+can be missed, it's why autopkg_tools.py only uses this when UPSTREAM_PRECHECK is set.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CACHE_DIR = os.path.expanduser("~/Library/AutoPkg/Cache")
+
+
+def find_info_files(cache_dir, identifier):
+    """List the .info.json files cached for a recipe identifier."""
+    info_files = []
+    for root, dirs, files in os.walk(os.path.join(cache_dir, identifier)):
+        for file in files:
+            if file.endswith(".info.json"):
+                info_files.append(os.path.join(root, file))
+    return info_files
+
+
+def load_info(info_path):
+    """Read the url and validators from an .info.json, None if it has no url."""
+    try:
+        with open(info_path, "r") as file:
+            data = json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"Error reading {info_path}: {e}")
+        return None
+    # the headers can be stored as-is or under their own keys
+    headers = {k.lower(): v for k, v in (data.get("http_headers") or {}).items()}
+    url = data.get("url") or data.get("download_url")
+    if not url:
+        return None
+    return {
+        "url": url,
+        "etag": data.get("etag") or headers.get("etag"),
+        "last_modified": data.get("last_modified") or headers.get("last-modified"),
+        "age": time.time() - os.path.getmtime(info_path),
+    }
+
+
+def upstream_changed(session, info, timeout):
+    """Ask the server if a cached download changed, errors count as changed."""
+    headers = {}
+    if info["etag"]:
+        headers["If-None-Match"] = info["etag"]
+    if info["last_modified"]:
+        headers["If-Modified-Since"] = info["last_modified"]
+    if not headers:
+        return True
+    try:
+        response = session.head(
+            info["url"], headers=headers, timeout=timeout, allow_redirects=True
+        )
+        if response.status_code in (403, 405, 501):
+            # no HEAD support, don't read the body of the GET
+            response = session.get(
+                info["url"],
+                headers=headers,
+                timeout=timeout,
+                allow_redirects=True,
+                stream=True,
+            )
+            response.close()
+    except requests.exceptions.RequestException as e:
+        print(f"Pre-check of {info['url']} failed: {e}")
+        return True
+    if response.status_code == 304:
+        return False
+    if response.status_code != 200:
+        return True
+    # plenty of servers ignore conditional headers, compare by hand
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if info["etag"] and etag:
+        return etag != info["etag"]
+    if info["last_modified"] and last_modified:
+        return last_modified != info["last_modified"]
+    return True
+
+
+def check_recipe(session, cache_dir, identifier, max_age_days, timeout):
+    """Check all cached downloads of a recipe, True if it needs a full run."""
+    info_files = find_info_files(cache_dir, identifier)
+    if not info_files:
+        return True
+    for info_path in info_files:
+        info = load_info(info_path)
+        if not info or info["age"] > max_age_days * 86400:
+            return True
+        if upstream_changed(session, info, timeout):
+            return True
+    return False
+
+
+def changed_recipes(
+    recipe_identifiers, cache_dir=None, max_age_days=7, workers=16, timeout=15
+):
+    """
+    Take a dict of recipe -> recipe identifier and return the set of recipes
+    whose upstream changed (or can't be checked) and need a full run.
+    """
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    changed = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for recipe, identifier in recipe_identifiers.items():
+            if not identifier:
+                changed.add(recipe)
+                continue
+            futures[recipe] = executor.submit(
+                check_recipe, session, cache_dir, identifier, max_age_days, timeout
+            )
+        for recipe, future in futures.items():
+            if future.result():
+                changed.add(recipe)
+    return changed
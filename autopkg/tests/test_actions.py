@@ -11,21 +11,30 @@ It currently has five main functions:
    the env var values in the steps that install Munki.
 
 4. If we have apps in the Munki GCP bucket that are not in any Munki pkgsinfo, it will
-   remove them from the bucket.
+   remove them from the bucket in batched requests (only reported with DRY_RUN).
+   Packages in the package manifest that are missing or different in the bucket are
+   reported too.
 
 5. Sends a Slack notification with the changes made.
 
 """
 
-import json
-import hashlib
 import os
 import re
 import requests
 import plistlib
-import yaml
-from google.cloud import storage
-from slack_sdk import WebClient
+import sys
+
+# Shared modules live in the helpers folder
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "helpers")
+)
+import gcs_pkgs
+import notify
+import pkg_manifest
+import pkginfo_index
+import recipe_catalog
+import release_pins
 
 ################################################
 ##################   CODE  #####################
@@ -34,6 +43,10 @@ from slack_sdk import WebClient
 
 # gcp bucket name
 gcp_bucket = os.environ.get("GCP_BUCKET")
+# Folder of the packages in the bucket
+gcp_pkgs_prefix = os.environ.get("GCP_PKGS_PREFIX", "pkgs/")
+# Only report orphaned packages unless DRY_RUN is set to false
+dry_run = os.environ.get("DRY_RUN", "true").lower() != "false"
 # Directory containing the pkgsinfo files
 pkgsinfo_dir = os.environ.get("PKGSINFO_DIR")
 # Define path to start searching for .munki.recipe(.yaml) files
@@ -51,89 +64,18 @@ repo_list_path = os.environ.get("REPO_LIST")
 #### Recipe stuff
 
 
-def extract_repo_from_path(path):
-    if "com.github.autopkg" in path:
-        # Extract everything after "com.github.autopkg." but before the next "/"
-        repo_name_match = re.search(r"com\.github\.autopkg\.([a-zA-Z0-9.-]+)", path)
-        if repo_name_match:
-            return repo_name_match.group(1)
-    return ""
-
-
-def extract_reponame_from_recipes(file_path):
-    """Extract repo names from Munki recipes."""
-    try:
-        with open(file_path, "rb") as plist_file:
-            plist_data = plistlib.load(plist_file)
-
-            repo_names = set()
-            # Check for 'parent_recipes' in 'ParentRecipeTrustInfo'
-            parent_recipe_info = plist_data.get("ParentRecipeTrustInfo", {}).get(
-                "parent_recipes", {}
-            )
-            for recipe_info in parent_recipe_info.values():
-                repo_name = extract_repo_from_path(recipe_info.get("path", ""))
-                if repo_name:
-                    repo_names.add(repo_name)
-            # Check for 'non_core_processors' in 'ParentRecipeTrustInfo'
-            non_core_processors = plist_data.get("ParentRecipeTrustInfo", {}).get(
-                "non_core_processors", {}
-            )
-            for processor_info in non_core_processors.values():
-                repo_name = extract_repo_from_path(processor_info.get("path", ""))
-                if repo_name:
-                    repo_names.add(repo_name)
-
-            return list(repo_names)
-
-    except Exception as e:
-        print(f"Error reading {file_path}: {e}")
-        return []
-
-
-def extract_reponame_from_yaml(file_path):
-    """Extract repo names from YAML files."""
-    try:
-        with open(file_path, "r") as yaml_file:
-            yaml_data = yaml.safe_load(yaml_file)
-
-            repo_names = set()
-            # Check for 'parent_recipes' in 'ParentRecipeTrustInfo'
-            parent_recipes = yaml_data.get("ParentRecipeTrustInfo", {}).get(
-                "parent_recipes", {}
-            )
-            for recipe_info in parent_recipes.values():
-                repo_name = extract_repo_from_path(recipe_info.get("path", ""))
-                if repo_name:
-                    repo_names.add(repo_name)
-            # Check for 'non_core_processors'
-            non_core_processors = yaml_data.get("ParentRecipeTrustInfo", {}).get(
-                "non_core_processors", {}
-            )
-            for processor_info in non_core_processors.values():
-                repo_name = extract_repo_from_path(processor_info.get("path", ""))
-                if repo_name:
-                    repo_names.add(repo_name)
-
-            return list(repo_names)
-
-    except Exception as e:
-        print(f"Error reading {file_path}: {e}")
-        return []
-
-
 def search_for_identifiers(folders_to_check):
     """Search for Munki recipe and YAML identifiers."""
     identifiers = set()
 
     for folder in folders_to_check:
-        for root, _, files in os.walk(folder):
-            for file_name in files:
-                file_path = os.path.join(root, file_name)
-                if file_name.endswith(".munki.recipe"):
-                    identifiers.update(extract_reponame_from_recipes(file_path))
-                elif file_name.endswith("munki.recipe.yaml"):
-                    identifiers.update(extract_reponame_from_yaml(file_path))
+        # only the overrides that changed since the last run get parsed again
+        catalog = recipe_catalog.load_catalog(folder)
+        identifiers.update(
+            recipe_catalog.source_repos(
+                catalog, suffixes=(".munki.recipe", "munki.recipe.yaml")
+            )
+        )
 
     return identifiers
 
@@ -141,7 +83,7 @@ def search_for_identifiers(folders_to_check):
 #### YAML stuff
 
 
-def update_yaml(yaml_path, new_sha256, new_url):
+def update_yaml(yaml_path, new_sha256, new_url, prefix="MUNKI"):
     """Update the YAML workflow with new values."""
     with open(yaml_path, "r") as file:
         yaml_text = file.read()
@@ -149,10 +91,12 @@ def update_yaml(yaml_path, new_sha256, new_url):
     # Update the YAML workflow with new values.
     # Why I do it this way is because any yaml lib was being difficult.
     updated_yaml = re.sub(
-        r'MUNKI_SHA256: ".+"', f'MUNKI_SHA256: "{new_sha256}"', yaml_text
+        rf'{prefix}_SHA256: ".+"', f'{prefix}_SHA256: "{new_sha256}"', yaml_text
     )
 
-    updated_yaml = re.sub(r'MUNKI_URL: ".+"', f'MUNKI_URL: "{new_url}"', updated_yaml)
+    updated_yaml = re.sub(
+        rf'{prefix}_URL: ".+"', f'{prefix}_URL: "{new_url}"', updated_yaml
+    )
 
     with open(yaml_path, "w") as file:
         file.write(updated_yaml)
@@ -161,55 +105,42 @@ def update_yaml(yaml_path, new_sha256, new_url):
 #### GCP bucket things
 
 
-def list_gcp_bucket_files(bucket_name):
-    """List all files in the GCP bucket."""
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blobs = bucket.list_blobs()
-    return {
-        os.path.basename(blob.name)
-        for blob in blobs
-        if blob.name.endswith((".pkg", ".dmg"))
-    }
+def list_munki_pkginfo_files(pkgsinfo_dir, manifest=None):
+    """List all package names from Munki's pkgsinfo directory."""
+    # the packages recorded at import time come from the package manifest,
+    # the index (only changed files get parsed again) covers the other pkginfo files
+    packages, covered = pkg_manifest.referenced(manifest or {}, pkgsinfo_dir)
+    index = pkginfo_index.load_index(pkgsinfo_dir)
+    packages.update(
+        pkginfo_index.installer_items(
+            {path: entry for path, entry in index.items() if path not in covered}
+        )
+    )
+    return packages
 
 
-def list_munki_pkginfo_files(pkgsinfo_dir):
-    """List all package names from Munki's pkgsinfo directory."""
-    munki_packages = set()
-
-    for root, dirs, files in os.walk(pkgsinfo_dir):
-        for file_name in files:
-            if file_name.endswith(".plist"):
-                plist_path = os.path.join(root, file_name)
-                try:
-                    with open(plist_path, "rb") as plist_file:
-                        plist_data = plistlib.load(plist_file)
-                        # Retrieve the installer item location
-                        installer_item_location = plist_data.get(
-                            "installer_item_location"
-                        )
-                        if installer_item_location:
-                            # Split the path and extract the package name
-                            # The package name is the last part of the path
-                            package_name = installer_item_location.split("/")[
-                                -1
-                            ]  # Get the last part
-                            munki_packages.add(package_name)
-                except Exception as e:
-                    print(f"Error parsing {plist_path}: {e}")
-
-    return munki_packages
-
-
-def find_superfluous_packages(pkgsinfo_dir, gcp_bucket):
-    """Find packages in the GCP bucket that are not in any Munki manifests."""
-    # List packages in the GCP bucket
-    gcp_packages = list_gcp_bucket_files(gcp_bucket)
+def find_superfluous_packages(pkgsinfo_dir, gcp_bucket, client=None, manifest=None):
+    """
+    Find packages in the GCP bucket that are not in any Munki pkginfo.
+    Returns the blob names of the orphaned packages, and the packages of the
+    package manifest that are missing from the bucket or differ there.
+    """
+    manifest = manifest or {}
     # List packages from Munki's pkgsinfo
-    munki_packages = list_munki_pkginfo_files(pkgsinfo_dir)
-    # Find packages in GCP that are not in Munki
-    orphaned_packages = gcp_packages - munki_packages
-    return list(orphaned_packages)
+    munki_packages = list_munki_pkginfo_files(pkgsinfo_dir, manifest)
+    # Compare the bucket listing as it streams in
+    listing = {}
+    orphaned_packages = []
+    for name, blob in gcs_pkgs.list_packages(gcp_bucket, gcp_pkgs_prefix, client):
+        listing[name] = blob
+        if os.path.basename(name) not in munki_packages:
+            orphaned_packages.append(name)
+    bucket_check = gcs_pkgs.check(manifest, listing, gcp_pkgs_prefix)
+    if not munki_packages:
+        # an empty index would make every package look orphaned
+        print("No packages found in the pkgsinfo, skipping the orphan check")
+        return [], bucket_check
+    return sorted(orphaned_packages), bucket_check
 
 
 #### Repo and identifiers stuff
@@ -263,76 +194,49 @@ def remove_unused_repos(repo_list_path, used_repos, edits):
 
 
 def url_sha_edit(yaml_file_path, github_token):
-    """Edit the Munki download URL and SHA256 checksum in the workflow file."""
-    # GitHub repository and release URL
-    repository = "munki/munki"
-    release_url = "https://api.github.com/repos/{}/releases/latest".format(repository)
-
-    # Better print output. Remove everything before and
-    # including the last slash.
-    last_slash_index = yaml_file_path.rfind("/")
-    yaml_filename = yaml_file_path[last_slash_index + 1 :]
-
+    """
+    Edit the Munki and AutoPkg download URLs and SHA256 checksums in the workflow
+    file. The latest releases are looked up and hashed once per run.
+    """
+    yaml_filename = os.path.basename(yaml_file_path)
     edit_status = ""
 
-    try:
-        # Get the latest release information
-        headers = {}
-        headers["Authorization"] = f"token {github_token}"
-        response = requests.get(release_url, headers=headers)
-        response.raise_for_status()
-        data = json.loads(response.text)
-
-        if "message" in data and data["message"] == "Not Found":
-            print("GitHub repository not found.")
-            return
-
-        # Extract the latest release information
-        assets = data.get("assets", [])
-
-        # Find the .pkg asset
-        pkg_asset = None
-        for asset in assets:
-            if asset["name"].endswith(".pkg"):
-                pkg_asset = asset
-                break
-        # If we find an asset matching .pkg
-        if pkg_asset is not None:
-            # Get the SHA256 checksum of the .pkg asset
-            pkg_url = pkg_asset["browser_download_url"]
-            pkg_response = requests.get(pkg_url)
-            pkg_response.raise_for_status()
-            pkg_sha256 = hashlib.sha256(pkg_response.content).hexdigest()
-
-            with open(yaml_file_path, "r") as file:
-                yaml_text = file.read()
-            # Extract the current values from the workflow file
-            current_sha256 = re.search(r"MUNKI_SHA256: \"([^\"]+)\"", yaml_text)
-            current_url = re.search(r"MUNKI_URL: \"([^\"]+)\"", yaml_text)
-            # These two exist in the workflow files we want to update
-            if current_sha256 and current_url:
-                current_sha256 = current_sha256.group(1)
-                current_url = current_url.group(1)
-                # Compare the calculated SHA256 with the current value
-                if pkg_sha256 != current_sha256:
-                    print(
-                        f"{yaml_filename}: SHA256 checksums do not match. Updating YAML file..."
-                    )
-                    # Update the YAML file
-                    update_yaml(yaml_file_path, pkg_sha256, pkg_url)
-                    edit_status = (
-                        f"{yaml_filename}: updated with new checksum and URL.\n"
-                    )
-                else:
-                    print(f"{yaml_filename}: SHA256 checksums and download URL match.")
-            else:
-                print(f"{yaml_filename}: Not applicable.")
+    with open(yaml_file_path, "r") as file:
+        yaml_text = file.read()
+    applicable = False
+    for prefix, repository in release_pins.PINS.items():
+        # Extract the current values from the workflow file
+        current_sha256 = re.search(rf"{prefix}_SHA256: \"([^\"]+)\"", yaml_text)
+        current_url = re.search(rf"{prefix}_URL: \"([^\"]+)\"", yaml_text)
+        # These two exist in the workflow files we want to update
+        if not (current_sha256 and current_url):
+            continue
+        applicable = True
+        try:
+            pin = release_pins.latest_pin(repository, github_token)
+        except requests.RequestException as e:
+            print(f"Error: {e}")
+            continue
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            continue
+        if pin is None:
+            edit_status += f"No .pkg asset found in the latest {repository} release.\n"
+            continue
+        # Compare the calculated SHA256 with the current value
+        if pin["sha256"] != current_sha256.group(1):
+            print(
+                f"{yaml_filename}: {prefix} SHA256 checksums do not match. Updating YAML file..."
+            )
+            # Update the YAML file
+            update_yaml(yaml_file_path, pin["sha256"], pin["url"], prefix)
+            edit_status += (
+                f"{yaml_filename}: updated {prefix} with new checksum and URL.\n"
+            )
         else:
-            edit_status = "No .pkg asset found in the latest release.\n"
-    except requests.RequestException as e:
-        print(f"Error: {e}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+            print(f"{yaml_filename}: {prefix} SHA256 checksums and download URL match.")
+    if not applicable:
+        print(f"{yaml_filename}: Not applicable.")
 
     return edit_status
 
@@ -353,8 +257,7 @@ def parse_manifest(manifest_path):
     return items
 
 
-def send_slack_notif(orphans, edits):
-    client = WebClient(token=os.environ["SLACK_BOT_TOKEN"])
+def send_slack_notif(orphans, edits, dispatcher):
     blocks = []
 
     if orphans:
@@ -386,25 +289,33 @@ def send_slack_notif(orphans, edits):
         blocks.extend(edits_blocks)
 
     if blocks:
-        response = client.chat_postMessage(
-            channel=os.environ["CHANNEL_ID"], blocks=blocks
+        # a future for the Slack response, delivered in the background
+        return dispatcher.call_api(
+            "chat.postMessage", {"channel": os.environ["CHANNEL_ID"], "blocks": blocks}
         )
-        return f"Message created: {response}"
 
 
 def orphans():
-    """Check for orphaned packages in the GCP bucket."""
-    orphaned_packages = find_superfluous_packages(pkgsinfo_dir, gcp_bucket)
+    """Check for orphaned packages in the GCP bucket and remove them."""
+    manifest = pkg_manifest.load_manifest(
+        os.path.join(munki_repo_dir, pkg_manifest.MANIFEST_NAME)
+    )
+    pkg_manifest.prune(manifest, pkgsinfo_dir)
+    orphaned_packages, bucket_check = find_superfluous_packages(
+        pkgsinfo_dir, gcp_bucket, manifest=manifest
+    )
     print(f"orphaned packages: {len(orphaned_packages)}")
+    removed = gcs_pkgs.delete_blobs(gcp_bucket, orphaned_packages, dry_run=dry_run)
     orphaned_message = []
-    if orphaned_packages:
-        orphaned_message.append("*Munki files removed from GCP bucket*:*")
-        if len(orphaned_packages) == 1:
-            # Only one orphaned app, no need for a comma and space
-            orphaned_message.append(orphaned_packages[0])
+    if removed:
+        if dry_run:
+            orphaned_message.append("*Orphaned Munki files in GCP bucket (dry run)*:")
         else:
-            # Multiple orphaned apps, list with comma and space
-            orphaned_message.extend(orphaned_packages)
+            orphaned_message.append("*Munki files removed from GCP bucket*:")
+        orphaned_message.extend(os.path.basename(name) for name in removed)
+    if bucket_check["missing"] or bucket_check["changed"]:
+        orphaned_message.append("*Munki packages missing or different in GCP bucket*:")
+        orphaned_message.extend(bucket_check["missing"] + bucket_check["changed"])
 
     return orphaned_message
 
@@ -446,15 +357,23 @@ def edits_made():
 
 
 def main():
+    dispatcher = notify.Dispatcher()
+    dispatcher.flush_spilled()
     edits = edits_made()
     orphaned_message = orphans()
     if orphaned_message or edits:
-        slack_status = send_slack_notif(orphaned_message, edits)
-        print(slack_status)
+        slack_status = send_slack_notif(orphaned_message, edits, dispatcher)
         # human intervention is then here required.
         # to automate this we may be taking too many assumptions, but there are ways to do it.
         # for example, we could have a slack message with a button that triggers the next step, or
         # we could also have a scheduled action that runs this script again after a certain amount of time.
+    dispatcher.close()
+    if orphaned_message or edits:
+        # a Slack failure is only logged, the cleanup itself is done
+        try:
+            print(f"Message created: {slack_status.result(timeout=10)}")
+        except Exception as e:
+            print(f"Slack Message post failed: {e}")
 
 
 if __name__ == "__main__":
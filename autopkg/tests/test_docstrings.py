@@ -2,10 +2,19 @@
 helper for gathering and comparing docstrings.
 
 Usage: python3 test_docstrings.py <current_script_content> <previous_script_content>
+       python3 test_docstrings.py --batch <previous_rev> <current_rev> [path ...]
+
+Batch mode reads both versions of every path (or of the paths on stdin when none
+are given) through a single `git cat-file --batch` process and prints json:
+{"changed": true/false, "files": {path: true/false}}. A path missing from a
+revision counts as having no docstring there.
 """
 
 import ast
+import json
+import subprocess
 import sys
+import threading
 
 
 def get_docstring(script_content):
@@ -26,10 +35,61 @@ def compare_docstrings(current_content, previous_content):
         return "TRUE"  # Docstring has changed
 
 
+def read_blobs(specs):
+    """Return the content of each rev:path spec through one git cat-file, None if missing."""
+    process = subprocess.Popen(
+        ["git", "cat-file", "--batch", "--buffer"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+
+    def write_specs():
+        for spec in specs:
+            process.stdin.write(f"{spec}\n".encode())
+        process.stdin.close()
+
+    writer = threading.Thread(target=write_specs, daemon=True)
+    writer.start()
+    blobs = []
+    for _ in specs:
+        header = process.stdout.readline().split()
+        if len(header) != 3 or header[1] != b"blob":
+            blobs.append(None)
+            continue
+        data = process.stdout.read(int(header[2]))
+        process.stdout.read(1)  # trailing newline
+        blobs.append(data.decode("utf-8", "replace"))
+    writer.join()
+    process.stdout.close()
+    process.wait()
+    return blobs
+
+
+def compare_revisions(paths, previous_rev, current_rev):
+    """Compare the docstring of every path between two revisions."""
+    specs = []
+    for path in paths:
+        specs += [f"{previous_rev}:{path}", f"{current_rev}:{path}"]
+    blobs = read_blobs(specs)
+    files = {}
+    for index, path in enumerate(paths):
+        previous_content, current_content = blobs[2 * index : 2 * index + 2]
+        files[path] = get_docstring(current_content or "") != get_docstring(
+            previous_content or ""
+        )
+    return {"changed": any(files.values()), "files": files}
+
+
 def main():
+    if sys.argv[1:2] == ["--batch"] and len(sys.argv) >= 4:
+        paths = sys.argv[4:] or [line.strip() for line in sys.stdin if line.strip()]
+        print(json.dumps(compare_revisions(paths, sys.argv[2], sys.argv[3]), indent=2))
+        return
+
     if len(sys.argv) != 3:
         print(
-            "Usage: python3 test_docstrings.py <current_script_content> <previous_script_content>"
+            "Usage: python3 test_docstrings.py <current_script_content> <previous_script_content>\n"
+            "       python3 test_docstrings.py --batch <previous_rev> <current_rev> [path ...]"
         )
         sys.exit(1)
 
@@ -0,0 +1,148 @@
+"""
+Checks gcs_pkgs.py against an in-memory fake of the google-cloud-storage client:
+the folder-wise package listing, the manifest comparison, dry runs and deletes in
+batches of BATCH_SIZE. Nothing talks to GCS.
+
+Usage: python3 test_gcs_pkgs.py
+"""
+
+import os
+import sys
+
+# Shared modules live in the helpers folder
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "helpers")
+)
+import gcs_pkgs
+
+
+class FakeBlob:
+    def __init__(self, name, size, md5_hash, crc32c=None):
+        self.name = name
+        self.size = size
+        self.md5_hash = md5_hash
+        self.crc32c = crc32c
+
+
+class FakeIterator:
+    """Like the storage HTTPIterator, prefixes is only set once it's been read."""
+
+    def __init__(self, blobs, prefixes):
+        self.blobs = blobs
+        self.prefixes = None
+        self.all_prefixes = prefixes
+
+    def __iter__(self):
+        yield from self.blobs
+        self.prefixes = set(self.all_prefixes)
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self.client = client
+
+    def __enter__(self):
+        self.client.batches.append([])
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeBucket:
+    def __init__(self, client):
+        self.client = client
+
+    def delete_blob(self, name):
+        self.client.batches[-1].append(name)
+        del self.client.blobs[name]
+
+
+class FakeClient:
+    def __init__(self, blobs):
+        # name -> (size, md5)
+        self.blobs = dict(blobs)
+        self.batches = []
+        self.listings = []
+
+    def list_blobs(self, bucket_name, prefix="", delimiter=None, fields=None):
+        self.listings.append((prefix, delimiter, fields))
+        names = sorted(name for name in self.blobs if name.startswith(prefix))
+        prefixes = set()
+        if delimiter:
+            direct = []
+            for name in names:
+                rest = name[len(prefix) :]
+                if delimiter in rest:
+                    prefixes.add(prefix + rest.split(delimiter)[0] + delimiter)
+                else:
+                    direct.append(name)
+            names = direct
+        blobs = [FakeBlob(name, *self.blobs[name]) for name in names]
+        return FakeIterator(blobs, prefixes)
+
+    def bucket(self, bucket_name):
+        return FakeBucket(self)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def check_listing():
+    client = FakeClient(
+        {
+            "pkgs/Top.pkg": (3, "top"),
+            "pkgs/apps/A.pkg": (1, "a"),
+            "pkgs/apps/B.dmg": (2, "b"),
+            "pkgs/apps/readme.txt": (1, "r"),
+            "pkgs/tools/C.pkg": (4, "c"),
+            "icons/A.png": (1, "i"),
+        }
+    )
+    listing = dict(gcs_pkgs.list_packages("bucket", "pkgs/", client))
+    assert sorted(listing) == [
+        "pkgs/Top.pkg",
+        "pkgs/apps/A.pkg",
+        "pkgs/apps/B.dmg",
+        "pkgs/tools/C.pkg",
+    ], listing
+    assert listing["pkgs/apps/B.dmg"] == {"size": 2, "md5": "b", "crc32c": None}
+    # one listing of the prefix, then one per folder, names and hashes only
+    assert sorted(prefix for prefix, _, _ in client.listings) == [
+        "pkgs/",
+        "pkgs/apps/",
+        "pkgs/tools/",
+    ]
+    assert all(fields == gcs_pkgs.FIELDS for _, _, fields in client.listings)
+
+    manifest = {
+        "apps/A.pkg": {"size": 1, "md5": "a"},
+        "apps/B.dmg": {"size": 2, "md5": "other"},
+        "tools/D.pkg": {"size": 5, "md5": "d"},
+    }
+    result = gcs_pkgs.check(manifest, listing, "pkgs/")
+    assert result == {"missing": ["tools/D.pkg"], "changed": ["apps/B.dmg"]}, result
+
+
+def check_deletes():
+    names = [f"pkgs/old/{number}.pkg" for number in range(250)]
+    client = FakeClient({name: (1, "x") for name in names})
+
+    would_delete = gcs_pkgs.delete_blobs("bucket", names, client, dry_run=True)
+    assert would_delete == names
+    assert not client.batches and len(client.blobs) == 250
+
+    deleted = gcs_pkgs.delete_blobs("bucket", names, client, dry_run=False)
+    assert deleted == names
+    assert [len(batch) for batch in client.batches] == [100, 100, 50]
+    assert not client.blobs
+
+
+def main():
+    check_listing()
+    check_deletes()
+    print("gcs_pkgs checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Checks github_api.py against a local fake GitHub API: issue pages followed through
+the Link headers with pull requests left out, ETag revalidation through http_cache,
+the Issue/Comment/PullRequest mapping and errors. Nothing talks to GitHub.
+
+Usage: python3 test_github_api.py
+"""
+
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+# Shared modules live in the helpers folder
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "helpers")
+)
+import github_api
+
+REPOSITORY = "example/munki"
+# every fifth item of the issues endpoint is a pull request
+ISSUES = [
+    dict(
+        {
+            "number": number,
+            "title": f"Issue {number}",
+            "html_url": f"https://github.com/{REPOSITORY}/issues/{number}",
+            "state": "open",
+            "updated_at": "2026-01-01T00:00:00Z",
+            "created_at": "2026-01-01T00:00:00Z",
+            "comments": 1,
+        },
+        **({"pull_request": {}} if number % 5 == 0 else {}),
+    )
+    for number in range(1, 151)
+]
+COMMENTS = [
+    {
+        "id": 10,
+        "user": {"login": "autopkg-bot"},
+        "body": "Still failing",
+        "created_at": "2026-01-02T00:00:00Z",
+        "issue_url": f"https://api.github.com/repos/{REPOSITORY}/issues/3",
+    }
+]
+PULLS = [
+    {
+        "number": 200,
+        "html_url": f"https://github.com/{REPOSITORY}/pull/200",
+        "state": "open",
+        "head": {"ref": "Firefox-126.0"},
+    }
+]
+
+
+class FakeGitHub(BaseHTTPRequestHandler):
+    # (method, path, status) of every request
+    requests = []
+
+    def send_json(self, status, data=None, headers=None):
+        body = json.dumps(data).encode() if data is not None else b""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        FakeGitHub.requests.append((self.command, self.path, status))
+
+    def send_page(self, items):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["30"])[0])
+        start = (page - 1) * per_page
+        headers = {"ETag": f'"{url.path}-{page}"'}
+        if self.headers.get("If-None-Match") == headers["ETag"]:
+            self.send_json(304, headers=headers)
+            return
+        if start + per_page < len(items):
+            headers["Link"] = (
+                f"<http://{self.headers['Host']}{url.path}?page={page + 1}"
+                f'&per_page={per_page}>; rel="next"'
+            )
+        self.send_json(200, items[start : start + per_page], headers)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        prefix = f"/repos/{REPOSITORY}/"
+        if path == prefix + "issues":
+            self.send_page(ISSUES)
+        elif path == prefix + "issues/comments":
+            self.send_page(COMMENTS)
+        elif path == prefix + "pulls":
+            self.send_json(200, PULLS)
+        else:
+            self.send_json(404, {"message": "Not Found"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        issue = dict(ISSUES[0], number=151, title=body["title"], comments=0)
+        self.send_json(201, issue)
+
+    def log_message(self, *args):
+        pass
+
+
+def statuses(method="GET"):
+    return [
+        status
+        for request_method, _, status in FakeGitHub.requests
+        if request_method == method
+    ]
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = github_api.GitHubClient(
+        REPOSITORY, "token", api_url=f"http://127.0.0.1:{server.server_port}"
+    )
+
+    # two pages of 100, pull requests dropped, typed issues
+    issues = client.list_issues()
+    assert len(issues) == 120, len(issues)
+    assert all(issue.number % 5 for issue in issues)
+    assert isinstance(issues[0], github_api.Issue)
+    assert issues[0].state == "OPEN" and issues[0].comment_count == 1
+    assert issues[0].url.endswith("/issues/1")
+    assert statuses() == [200, 200], FakeGitHub.requests
+
+    # the same listing again is revalidated with the ETags and costs only 304s
+    assert client.list_issues() == issues
+    assert statuses() == [200, 200, 304, 304], FakeGitHub.requests
+
+    comments = client.list_comments()
+    assert comments == [
+        github_api.Comment(
+            id=10,
+            author="autopkg-bot",
+            body="Still failing",
+            created_at="2026-01-02T00:00:00Z",
+            issue_number=3,
+        )
+    ], comments
+
+    pull_request = client.find_pull_request("Firefox-126.0")
+    assert pull_request == github_api.PullRequest(
+        number=200,
+        url=f"https://github.com/{REPOSITORY}/pull/200",
+        state="OPEN",
+        head="Firefox-126.0",
+    ), pull_request
+
+    issue = client.create_issue("Firefox failed", "log")
+    assert issue.number == 151 and issue.title == "Firefox failed", issue
+
+    # errors come back as GitHubError with the response body
+    try:
+        client.list_issue_comments(999999)
+    except github_api.GitHubError as e:
+        assert "Not Found" in str(e), e
+    else:
+        raise AssertionError("a 404 should raise GitHubError")
+
+    server.shutdown()
+    print("github_api checks passed")
+
+
+if __name__ == "__main__":
+    main()
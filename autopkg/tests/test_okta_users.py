@@ -0,0 +1,140 @@
+"""
+Checks okta_users.py against a local fake Okta server: department prefetch paging
+through the Link headers, waiting out the X-Rate-Limit headers and 429s, the TTL
+cache on disk and single lookups of unknown users. Nothing talks to Okta.
+
+Usage: python3 test_okta_users.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import quote
+from urllib.parse import urlparse
+
+# Shared modules live in the helpers folder
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "helpers")
+)
+import okta_users
+
+USERS = [
+    {
+        "id": f"u{number}",
+        "status": "ACTIVE",
+        "profile": {
+            "login": f"user{number}@example.com",
+            "department": "Engineering",
+            "mobilePhone": "not cached",
+        },
+    }
+    for number in range(450)
+]
+
+
+class FakeOkta(BaseHTTPRequestHandler):
+    # paths requested, and how many of the next requests get a 429
+    requests = []
+    throttle = 0
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        FakeOkta.requests.append(self.path)
+        reset = str(int(time.time()))
+        if FakeOkta.throttle:
+            FakeOkta.throttle -= 1
+            self.send_json(
+                429, {"errorCode": "E0000047"}, {"X-Rate-Limit-Reset": reset}
+            )
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/api/v1/users":
+            department = query["search"][0].split('"')[1]
+            matches = [
+                user for user in USERS if user["profile"]["department"] == department
+            ]
+            start = int(query.get("after", ["0"])[0])
+            limit = int(query["limit"][0])
+            headers = {"X-Rate-Limit-Remaining": "100", "X-Rate-Limit-Reset": reset}
+            if start + limit < len(matches):
+                next_url = (
+                    f"http://{self.headers['Host']}/api/v1/users?after={start + limit}"
+                    f"&limit={limit}&search={quote(query['search'][0])}"
+                )
+                headers["Link"] = f'<{next_url}>; rel="next"'
+            # the last page leaves the limit nearly used up
+            else:
+                headers["X-Rate-Limit-Remaining"] = "1"
+            self.send_json(200, matches[start : start + limit], headers)
+            return
+        self.send_json(404, {"errorCode": "E0000007"})
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOkta)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_port}"
+    cache_path = os.path.join(tempfile.mkdtemp(), "okta_users.json")
+    sleeps = []
+    okta_users.time.sleep = sleeps.append
+
+    # a miss prefetches the department: 450 users in three pages of 200
+    client = okta_users.OktaClient("example", "token", api_url, cache_path)
+    for number in range(450):
+        user = client.get_user(f"user{number}@example.com", "Engineering")
+        assert user and user["id"] == f"u{number}", user
+    assert len(FakeOkta.requests) == 3, FakeOkta.requests
+    assert "mobilePhone" not in client.cached("user1@example.com")["profile"]
+    # the nearly used up limit on the last page waited for the reset
+    assert len(sleeps) == 1, sleeps
+
+    # unknown users cost one lookup and come back as None
+    assert client.get_user("nobody@example.com", "Engineering") is None
+    assert len(FakeOkta.requests) == 4
+    client.save()
+
+    # a 429 is waited out and retried
+    FakeOkta.throttle = 2
+    client.prefetched.clear()
+    client.cache.clear()
+    assert client.get_user("user7@example.com", "Engineering")
+    assert len(sleeps) == 4, sleeps
+
+    # a new run answers from the cache on disk without a request
+    requests_before = len(FakeOkta.requests)
+    client = okta_users.OktaClient("example", "token", api_url, cache_path)
+    assert client.get_user("user42@example.com", "Engineering")
+    assert len(FakeOkta.requests) == requests_before
+
+    # expired users are misses and are dropped when the cache is saved
+    client = okta_users.OktaClient("example", "token", api_url, cache_path, ttl=0)
+    assert client.cached("user42@example.com") is None
+    client.save()
+    with open(cache_path) as file:
+        assert json.load(file) == {}
+
+    server.shutdown()
+    print("okta_users checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Checks pkg_manifest.py on a temporary pkgsinfo folder: pruning entries whose pkginfo
+is gone or was never recorded, referenced() and compare() against a bucket listing.
+
+Usage: python3 test_pkg_manifest.py
+"""
+
+import os
+import sys
+import tempfile
+
+# Shared modules live in the helpers folder
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "helpers")
+)
+import pkg_manifest
+
+
+def check_prune(pkgsinfo_dir):
+    manifest = {}
+    pkg_manifest.record(manifest, "apps/A.pkg", {"size": 1, "md5": "a"}, "apps/A.plist")
+    pkg_manifest.record(manifest, "apps/B.pkg", {"size": 2, "md5": "b"}, "apps/B.plist")
+    # an import without a pkginfo path, and one from an older manifest
+    pkg_manifest.record(manifest, "apps/C.pkg", {"size": 3, "md5": "c"}, None)
+    manifest["apps/D.pkg"] = {"size": 4, "md5": "d"}
+
+    removed = pkg_manifest.prune(manifest, pkgsinfo_dir)
+    assert sorted(removed) == ["apps/B.pkg", "apps/C.pkg", "apps/D.pkg"], removed
+    assert list(manifest) == ["apps/A.pkg"], manifest
+    return manifest
+
+
+def check_referenced(manifest, pkgsinfo_dir):
+    manifest = dict(manifest, **{"apps/E.pkg": {"size": 5, "pkginfo": None}})
+    packages, pkginfo_paths = pkg_manifest.referenced(manifest, pkgsinfo_dir)
+    assert packages == {"A.pkg"}, packages
+    assert pkginfo_paths == {"apps/A.plist"}, pkginfo_paths
+
+
+def check_compare():
+    manifest = {
+        "apps/A.pkg": {"size": 1, "md5": "a"},
+        "apps/B.pkg": {"size": 2, "md5": "b", "crc32c": "x"},
+        "apps/C.pkg": {"size": 3, "md5": "c"},
+    }
+    remote = {
+        "apps/A.pkg": {"size": 1, "md5": "a", "crc32c": None},
+        "apps/B.pkg": {"size": 2, "md5": "b", "crc32c": "y"},
+    }
+    result = pkg_manifest.compare(manifest, remote)
+    assert result == {"missing": ["apps/C.pkg"], "changed": ["apps/B.pkg"]}, result
+
+
+def main():
+    pkgsinfo_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(pkgsinfo_dir, "apps"))
+    open(os.path.join(pkgsinfo_dir, "apps", "A.plist"), "w").close()
+    manifest = check_prune(pkgsinfo_dir)
+    check_referenced(manifest, pkgsinfo_dir)
+    check_compare()
+    print("pkg_manifest checks passed")
+
+
+if __name__ == "__main__":
+    main()